@@ -1,92 +1,320 @@
+import asyncio
+import functools
 import os
 import time
-import tempfile
-from slack_bolt.adapter.socket_mode import SocketModeHandler
-from slack_bolt.app import App
+
+_import_start = time.perf_counter()
+
+from concurrent.futures import ThreadPoolExecutor
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from slack_bolt.async_app import AsyncApp
 from dotenv import load_dotenv
 
 load_dotenv(".env")
 
 import config
 from utils.log import setup_logger
-from cluster.node import get_node_info, get_squeue
+from cluster.accounting import format_report, prepare_report, release_report
+from cluster.botstats import format_bot_stats
+from cluster.clusters import parse_cluster_args, start_cluster_workers
+from cluster.node import get_node_info, get_squeue, get_topology, parse_squeue_flags
+from cluster.delta import get_job_watcher, handle_watch
+from cluster.history import get_history_store, get_usage_report, parse_usage_args
+from cluster.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, format_prometheus_metrics
 from cluster.query_slurm import get_slurm_version
+from cluster.render import table_blocks
+from cluster.snapshot import get_snapshot_service
+from cluster.topology import warm_up as start_render_pool
+from utils.channels import get_channel_membership, require_bot_in_channel
+from utils.http_server import register_route, start_http_server
+from utils.slack2unix import get_slack2unix_map, lookup_unix_user
+from utils.startup import StartupTimer
+from utils.trace import span, traced
+from utils.utils import get_user_directory
+
+startup = StartupTimer(_import_start)
+startup.record("imports", time.perf_counter() - _import_start)
 
-logger = setup_logger(output=config.LOGGER_OUTPUT, level=config.LOGGER_LEVEL)
+logger = setup_logger(
+    output=config.LOGGER_OUTPUT,
+    level=config.LOGGER_LEVEL,
+    use_queue=config.LOGGER_QUEUE,
+    json_lines=config.LOGGER_JSON,
+    max_bytes=config.LOGGER_MAX_BYTES,
+    rotate_seconds=config.LOGGER_ROTATE_SECONDS,
+    backup_count=config.LOGGER_BACKUP_COUNT,
+)
 
-app = App(
+app = AsyncApp(
     token=os.environ["SLACK_BOT_TOKEN"],
     signing_secret=os.environ["SLACK_SIGNING_SECRET"],
     logger=logger,
 )
+# per-request clients copy the base URL from here
+app.client.base_url = config.SLACK_API_URL
+
+# answer slash commands only in channels the bot is a member of
+app.use(require_bot_in_channel())
+
+# pyslurm queries, DataFrame work and table rendering run here so they never block the event loop
+executor = ThreadPoolExecutor(max_workers=config.WORKER_THREADS, thread_name_prefix="slurm-worker")
+# /report chunks (slow slurmdbd queries) get their own threads; this bounds the queries in flight and
+# a report waiting for one never holds a worker the other commands need
+report_executor = ThreadPoolExecutor(max_workers=config.REPORT_CONCURRENT_QUERIES, thread_name_prefix="report-worker")
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+def _execution_time(start):
+    return f"Execution time: {((time.time() * 1000) - start):.2f} milliseconds"
+
+async def reply_table(say, client, channel_id, text, title, filename, footer=None):
+    """Post small tables inline as Block Kit sections and upload large ones straight from memory."""
+    if len(text) <= config.INLINE_TABLE_MAX_CHARS:
+        blocks = table_blocks(text)
+        if footer:
+            blocks.append({"type": "context", "elements": [{"type": "mrkdwn", "text": footer}]})
+        with span("slack.say"):
+            await say(blocks=blocks, text=title)
+        return
+    with span("slack.files_upload"):
+        await client.files_upload_v2(
+            channel=channel_id,
+            title=title,
+            filename=filename,
+            content=text,
+            initial_comment=f"Here's your {title.lower()}:"
+        )
+    if footer:
+        with span("slack.say"):
+            await say(footer)
 
 @app.command("/cluster")
-def cluster_command(ack, say):
+@traced("command.cluster")
+async def cluster_command(ack, command, say, client):
+    """
+    Handles `/cluster [-M <cluster>|all]` to display basic Slurm node information.
+    """
+    start = time.time() * 1000
+    await ack()
+    cluster, _ = parse_cluster_args(command.get("text"))
+    node_info = await run_blocking(get_node_info, cluster)
+    await reply_table(say, client, command['channel_id'], node_info, "Slurm Node Information", "cluster_results.txt",
+                      footer=_execution_time(start))
+
+@app.command("/topology")
+@traced("command.topology")
+async def topology_command(ack, command, say, client):
     """
-    Handles the /cluster command to display basic Slurm node information.
+    Handles the /topology command: a graph of partitions and their nodes, coloured by CPU usage.
     """
     start = time.time() * 1000
-    ack()
-    node_info = get_node_info()
-    output = f"```\n{node_info}\n```\n\n"
-    output += f"Execution time: {((time.time() * 1000) - start):.2f} milliseconds"
-    say(output)
-    
+    await ack()
+    topology = await run_blocking(get_topology)
+    if isinstance(topology, str):
+        await say(topology)
+        return
+    with span("slack.files_upload"):
+        await client.files_upload_v2(
+            channel=command['channel_id'],
+            title="Slurm Topology",
+            filename="topology.png",
+            content=topology,
+            initial_comment=_execution_time(start)
+        )
+
 @app.command("/squeue")
-def squeue_command(ack, command, say, client):
-    # TODO: Hide command when not in channel or handle errors otherwise
-    
+@traced("command.squeue")
+async def squeue_command(ack, command, say, client):
+    start = time.time() * 1000
+    await ack()
+
+    user_id = command['user_id']
+    cluster, text = parse_cluster_args(command.get("text"))
+    text, expand = parse_squeue_flags(text)
+    username = text or await run_blocking(lookup_unix_user, user_id)
+    real_name = None
+    if not username:
+        # not in the Slack to Unix map yet, fall back to matching the Slack real name
+        with span("slack.users_info"):
+            result = await client.users_info(user=user_id)
+        real_name = result["user"].get("real_name")
+
+    squeue = await run_blocking(get_squeue, real_name, username=username, cluster=cluster, expand=expand)
+    await reply_table(say, client, command['channel_id'], squeue, "Job Queue Information", "squeue_results.txt",
+                      footer=_execution_time(start))
+
+@app.command("/usage")
+@traced("command.usage")
+async def usage_command(ack, command, say, client):
+    """
+    Handles `/usage [partition] [<n>h|<n>d|<n>w]`: partition utilization over a past window.
+    """
     start = time.time() * 1000
-    ack()
-    
+    await ack()
+    partition, window = parse_usage_args(command.get("text"))
+    usage = await run_blocking(get_usage_report, partition, window)
+    await reply_table(say, client, command['channel_id'], usage, "Usage Report", "usage_results.txt",
+                      footer=_execution_time(start))
+
+@app.command("/report")
+@traced("command.report")
+async def report_command(ack, command, say, respond, client):
+    """
+    Handles `/report [<n>h|<n>d|<n>w]`, `/report <YYYY-MM-DD> <YYYY-MM-DD>`, `/report cancel` and
+    `/report resume`: CPU- and GPU-hours per user, partition and account from slurmdbd.
+    """
+    start = time.time() * 1000
+    await ack()
     user_id = command['user_id']
-    username = command.get("text")
-    result = client.users_info(user=user_id)
-    user = result["user"]
-    real_name = user.get("real_name")
-    
-    squeue = get_squeue(real_name, username=username)
-
-    with tempfile.NamedTemporaryFile(mode='w+', suffix='.txt', delete=False) as tmp:
-        tmp.write(squeue)
-        tmp_name = tmp.name
-    
-    client.files_upload_v2(
-        channel=command['channel_id'],
-        title="Job Queue Information",
-        filename="squeue_results.txt",
-        file=tmp_name,
-        initial_comment="Here's your job queue information:"
-    )
-    say(f"Execution time: {((time.time() * 1000) - start):.2f} milliseconds")
-    
+    report, reply = await run_blocking(prepare_report, command.get("text"), user_id)
+    await respond(reply)
+    if report is None:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+        while not report.done and not report.cancelled:
+            await loop.run_in_executor(report_executor, report.run_chunk)
+    except Exception as e:
+        logger.error(f"Accounting report for {user_id} failed after {report.chunks_done} chunks: {e}")
+        await say(f"Your accounting report stopped after {report.chunks_done} of {report.chunks} chunks "
+                  f"({e}); `/report resume` continues it.")
+        return
+    finally:
+        await run_blocking(release_report, user_id, report)
+    if not report.done:
+        await say(f"Accounting report cancelled after {report.chunks_done} of {report.chunks} chunks; "
+                  f"`/report resume` continues it.")
+        return
+    text = await run_blocking(format_report, report)
+    await reply_table(say, client, command['channel_id'], text, "Accounting Report", "report.txt",
+                      footer=_execution_time(start))
+
+@app.command("/watch")
+@traced("command.watch")
+async def watch_command(ack, command, respond):
+    """
+    Handles `/watch <jobid|username>`: post job state changes to this channel as they happen.
+    """
+    await ack()
+    reply = await run_blocking(handle_watch, command.get("text"), command['channel_id'], command['user_id'])
+    await respond(reply)
+
+@app.command("/botstats")
+async def botstats_command(ack, command, say, client):
+    """
+    Handles the /botstats command: per-stage latency percentiles and cache hit rates of this bot.
+    """
+    await ack()
+    stats = await run_blocking(format_bot_stats)
+    await reply_table(say, client, command['channel_id'], stats, "Bot Statistics", "botstats.txt")
+
 @app.command("/version")
-def get_my_id(ack):
-    ack(text=f"Current version of SLURM is {get_slurm_version()}")
-    
+@traced("command.version")
+async def get_version(ack, respond):
+    await ack()
+    version = await run_blocking(get_slurm_version)
+    await respond(f"Current version of SLURM is {version}")
+
 @app.command("/myid")
-def get_my_id(ack, body):
+async def get_my_id(ack, body):
     user_id = body["user_id"]
-    ack(text=f"Your Slack User ID is: {user_id}")
-    
+    await ack(text=f"Your Slack User ID is: {user_id}")
+
 @app.command("/debug")
-def handle_command(ack, say, command, client):
-    ack()
+async def handle_command(ack, say, command, client):
+    await ack()
     user_id = command['user_id']
     if not user_id == os.environ["PERSONAL_SLACK_USER_ID"]:
-        say("Invalid permissions")
+        await say("Invalid permissions")
     try:
-        result = client.users_info(user=user_id)
+        result = await client.users_info(user=user_id)
         user = result["user"]
         real_name = user.get("real_name")
         username = user.get("name")
         logger.info(f"Real name: {real_name}, Username: {username}")
-        client.chat_postMessage(
+        await client.chat_postMessage(
             channel=command['channel_id'],
             text=f"Hello {real_name} (@{username})!"
         )
     except Exception as e:
         logger.error(f"Error fetching user info: {e}")
 
+@app.event("member_joined_channel")
+@app.event("member_left_channel")
+async def member_channel_event(event):
+    get_channel_membership().on_member_event(event)
+
+def _post_from_thread(loop):
+    """`JobWatcher.notify` callback: snapshot subscribers run on the refresher thread, Slack calls on the loop."""
+    def notify(channel_id, slack_user_id, text):
+        future = asyncio.run_coroutine_threadsafe(app.client.chat_postMessage(channel=channel_id, text=text), loop)
+
+        def delivered(future):
+            # the Slack call fails here, after dispatch() has returned (not_in_channel, rate limits, ...)
+            if not future.cancelled() and future.exception() is not None:
+                logger.error(f"Could not deliver job updates to {slack_user_id} in {channel_id}: {future.exception()}")
+        future.add_done_callback(delivered)
+    return notify
+
+async def warm_up(service):
+    """
+    Fill the snapshot, user directory and Slack to Unix caches before taking
+    commands, so the first /cluster or /squeue doesn't pay for cold queries.
+    Steps still running after STARTUP_WARMUP_TIMEOUT finish in the background.
+    """
+    def first_snapshot():
+        if service.wait_ready(config.STARTUP_WARMUP_TIMEOUT):
+            # render once so the first /cluster doesn't pay for the cold formatting path either
+            get_node_info()
+
+    async def step(name, func):
+        with startup.phase(f"warm-up: {name}"):
+            await run_blocking(func)
+
+    steps = {
+        "snapshot": first_snapshot,
+        "slurm version": get_slurm_version,
+        "user directory": lambda: get_user_directory().users,
+        "slack2unix map": get_slack2unix_map,
+    }
+    tasks = {asyncio.ensure_future(step(name, func)): name for name, func in steps.items()}
+    with startup.phase("warm-up"):
+        done, pending = await asyncio.wait(tasks, timeout=config.STARTUP_WARMUP_TIMEOUT)
+    for task in done:
+        if task.exception() is not None:
+            logger.warning(f"Warm-up of {tasks[task]} failed: {task.exception()}")
+    if pending:
+        logger.warning(f"Still warming up {', '.join(tasks[task] for task in pending)} "
+                       f"after {config.STARTUP_WARMUP_TIMEOUT}s, taking commands anyway")
+
+async def main():
+    with startup.phase("slack identity"):
+        await get_channel_membership().resolve_identity(app.client)
+    # fork the render workers before the snapshot and worker threads exist
+    with startup.phase("render pool"):
+        start_render_pool()
+    service = get_snapshot_service()
+    history = get_history_store()
+    service.subscribe(history.record)
+    history.start_compactor()
+    watcher = get_job_watcher()
+    watcher.notify = _post_from_thread(asyncio.get_running_loop())
+    service.subscribe(watcher.on_snapshot)
+    service.start()
+    start_cluster_workers()
+    if config.HTTP_PORT is not None:
+        register_route("/stats", format_bot_stats)
+        if config.METRICS_EXPORTER:
+            register_route("/metrics", format_prometheus_metrics, METRICS_CONTENT_TYPE)
+        start_http_server()
+    await warm_up(service)
+    handler = AsyncSocketModeHandler(app, os.environ["SLACK_APP_TOKEN"])
+    with startup.phase("socket mode connect"):
+        await handler.connect_async()
+    startup.report()
+    await asyncio.sleep(float("inf"))
+
 if __name__ == "__main__":
-    SocketModeHandler(app, app_token=os.environ["SLACK_APP_TOKEN"]).start()
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,204 @@
+"""
+Benchmark the Slurm ingest/transform/render pipeline against the captured fixtures.
+
+Each scenario runs in a fresh worker process with `cluster.fixtures.FixtureSlurm`
+plugged in as the pyslurm source, so peak memory is measured per scenario.
+
+    python benchmark.py                          # default scenarios
+    python benchmark.py --scenario jobs-100x -n 10
+    python benchmark.py --save bench.json        # record a baseline
+    python benchmark.py --compare bench.json     # exit 1 on regressions
+"""
+import argparse
+import json
+import multiprocessing
+import queue as queue_module
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+from tabulate import tabulate
+
+# name -> (node_scale, job_scale)
+SCENARIOS = {
+    "baseline": (1, 1),
+    "jobs-10x": (1, 10),
+    "jobs-100x": (1, 100),
+    "nodes-1000": (25, 1),
+    "large": (25, 100),
+}
+
+
+def _time(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def _run_scenario(name, node_scale, job_scale, repeat, trace_python, queue):
+    # imported here so every worker process starts from a clean module state
+    from cluster.fixtures import FixtureSlurm
+    from cluster.query_slurm import set_slurm_source, get_slurm_partition_df, get_slurm_job_df, get_slurm_statistics_df
+    from cluster.node import format_node_info, format_squeue
+
+    source = FixtureSlurm(node_scale=node_scale, job_scale=job_scale)
+    set_slurm_source(source)
+
+    if trace_python:
+        tracemalloc.start()
+    stages = {}
+    wall_start = time.perf_counter()
+
+    # `__wrapped__` bypasses the getters' TTL cache so every repeat does the real work
+    for kind, getter in (("node", get_slurm_partition_df), ("job", get_slurm_job_df), ("statistics", get_slurm_statistics_df)):
+        fetches, transforms = [], []
+        for _ in range(repeat):
+            fetched_before = source.fetch_seconds[kind]
+            start = time.perf_counter()
+            df = getter.__wrapped__()
+            elapsed = time.perf_counter() - start
+            fetches.append(source.fetch_seconds[kind] - fetched_before)
+            transforms.append(elapsed - fetches[-1])
+        stages[f"fetch_{kind}"] = fetches
+        stages[f"transform_{kind}"] = transforms
+        if kind == "node":
+            partition_df = df
+        elif kind == "job":
+            job_df = df
+
+    stages["render_node_info"], _ = _time(lambda: format_node_info(partition_df), repeat)
+    unix_uid = job_df["user_id"].mode().sort()[0]
+    stages["render_squeue"], _ = _time(lambda: format_squeue(job_df, unix_uid, "benchmark"), repeat)
+
+    wall = time.perf_counter() - wall_start
+    py_peak = None
+    if trace_python:
+        _, py_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    queue.put({
+        "scenario": name,
+        "nodes": source.num_nodes,
+        "jobs": source.num_jobs,
+        "repeat": repeat,
+        "wall_seconds": wall,
+        "python_peak_bytes": py_peak,
+        # ru_maxrss is reported in KiB on Linux
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "stages": {stage: {"min": min(t), "median": statistics.median(t)} for stage, t in stages.items()},
+    })
+
+
+def _wait_for_result(proc, queue, poll_seconds=1.0):
+    """The scenario's result, or None if its worker process exited without one (it raised or was killed)."""
+    while True:
+        try:
+            return queue.get(timeout=poll_seconds)
+        except queue_module.Empty:
+            if not proc.is_alive():
+                # a result put just before exiting may still be in flight
+                try:
+                    return queue.get(timeout=poll_seconds)
+                except queue_module.Empty:
+                    return None
+
+
+def run(scenarios, repeat, trace_python=False):
+    """Run `scenarios` one worker process each. Returns (results, names of the scenarios that failed)."""
+    ctx = multiprocessing.get_context("spawn")
+    results, failed = [], []
+    for name in scenarios:
+        node_scale, job_scale = SCENARIOS[name]
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run_scenario, args=(name, node_scale, job_scale, repeat, trace_python, queue))
+        proc.start()
+        result = _wait_for_result(proc, queue)
+        proc.join()
+        if result is None:
+            print(f"Scenario {name} failed (worker exit code {proc.exitcode})", file=sys.stderr)
+            failed.append(name)
+        else:
+            results.append(result)
+    return results, failed
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.2f}"
+
+
+def _mb(num_bytes):
+    if num_bytes is None:
+        return "-"
+    return f"{num_bytes / 2**20:.1f}"
+
+
+def report(results):
+    summary = [
+        [r["scenario"], r["nodes"], r["jobs"], _ms(r["wall_seconds"]), _mb(r["python_peak_bytes"]), _mb(r["max_rss_bytes"])]
+        for r in results
+    ]
+    print(tabulate(summary, headers=["Scenario", "Nodes", "Jobs", "Wall (ms)", "Py peak (MB)", "Max RSS (MB)"], tablefmt="github"))
+    print()
+    stage_names = list(results[0]["stages"])
+    rows = [[stage] + [_ms(r["stages"][stage]["median"]) for r in results] for stage in stage_names]
+    print("Median stage time (ms):")
+    print(tabulate(rows, headers=["Stage"] + [r["scenario"] for r in results], tablefmt="github"))
+
+
+def compare(results, baseline, threshold):
+    """Print stages slower than `baseline` by more than `threshold` (a fraction). Returns True if any regressed."""
+    by_name = {r["scenario"]: r for r in baseline}
+    regressions = []
+    for result in results:
+        base = by_name.get(result["scenario"])
+        if base is None:
+            continue
+        for stage, timing in result["stages"].items():
+            if stage not in base["stages"]:
+                continue
+            before, after = base["stages"][stage]["median"], timing["median"]
+            if before > 0 and (after - before) / before > threshold:
+                regressions.append([result["scenario"], stage, _ms(before), _ms(after), f"{(after - before) / before:+.0%}"])
+    if regressions:
+        print()
+        print(f"Regressions over {threshold:.0%}:")
+        print(tabulate(regressions, headers=["Scenario", "Stage", "Before (ms)", "After (ms)", "Change"], tablefmt="github"))
+    return bool(regressions)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="scenario(s) to run (default: all)")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="repetitions per stage")
+    parser.add_argument("--trace-python", action="store_true",
+                        help="also record the Python heap peak with tracemalloc (slows the run down considerably)")
+    parser.add_argument("--save", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown counted as a regression")
+    args = parser.parse_args(argv)
+
+    results, failed = run(args.scenario or list(SCENARIOS), args.repeat, args.trace_python)
+    if results:
+        report(results)
+    if failed:
+        print(f"\nFailed scenarios: {', '.join(failed)}", file=sys.stderr)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+import polars as pl
+
+import config
+from cluster.history import parse_duration
+from cluster.query_slurm import get_slurmdb_jobs
+from cluster.render import render_table
+from utils.log import get_logger
+from utils.trace import span
+from utils.utils import get_user_directory
+
+logger = get_logger(__name__)
+
+KEYS = ["user", "partition", "account"]
+TOTALS = ["cpu_hours", "gpu_hours", "jobs"]
+# the slurmdbd record fields a report reads
+DB_JOB_SCHEMA = {
+    "user": pl.Utf8,
+    "uid": pl.Int64,
+    "account": pl.Utf8,
+    "partition": pl.Utf8,
+    "start": pl.Int64,
+    "end": pl.Int64,
+    "tres_alloc_str": pl.Utf8,
+}
+TOTALS_SCHEMA = {"user": pl.Utf8, "partition": pl.Utf8, "account": pl.Utf8,
+                 "cpu_hours": pl.Float64, "gpu_hours": pl.Float64, "jobs": pl.Int64}
+REPORT_USAGE = ("Usage: `/report [<n>h|<n>d|<n>w]`, `/report <YYYY-MM-DD> <YYYY-MM-DD>`, "
+                "`/report cancel` or `/report resume`.")
+
+
+def _tres_count(name):
+    # "cpu=32,mem=100G,gres/gpu=2" or, as slurmdbd stores it, "1=32,2=102400,1001=2"; absent -> 0
+    names = [re.escape(name)]
+    if name in config.REPORT_TRES_IDS:
+        names.append(re.escape(config.REPORT_TRES_IDS[name]))
+    pattern = rf"(?:^|,)(?:{'|'.join(names)})=(\d+)"
+    return pl.col("tres_alloc_str").str.extract(pattern, 1).cast(pl.Int64).fill_null(0)
+
+
+def chunk_usage(records, start, end, now=None) -> pl.DataFrame:
+    """
+    CPU- and GPU-hours per (user, partition, account) accrued between `start` and
+    `end` (epoch seconds) by the slurmdbd `records` of that window. Only the part
+    of each job inside the window counts, so a job spanning several chunks is
+    never counted twice; jobs still running (end 0) count up to `now`. `jobs`
+    counts the jobs that started in the window.
+    """
+    now = time.time() if now is None else now
+    df = pl.from_dicts(list(records.values()), schema=DB_JOB_SCHEMA) if records else pl.DataFrame(schema=DB_JOB_SCHEMA)
+    job_end = pl.when(pl.col("end") > 0).then(pl.col("end")).otherwise(pl.lit(int(now)))
+    seconds = (pl.min_horizontal(job_end, pl.lit(end)) - pl.max_horizontal(pl.col("start"), pl.lit(start))).clip(lower_bound=0)
+    return (df.lazy()
+        # pending jobs have no start time and used nothing
+        .filter(pl.col("start") > 0)
+        .select(
+            pl.coalesce(pl.col("user"), pl.col("uid").cast(pl.Utf8)).alias("user"),
+            pl.col("partition").fill_null(""),
+            pl.col("account").fill_null(""),
+            (seconds * _tres_count("cpu") / 3600).alias("cpu_hours"),
+            (seconds * _tres_count("gres/gpu") / 3600).alias("gpu_hours"),
+            pl.col("start").is_between(start, end, closed="left").cast(pl.Int64).alias("jobs"),
+        )
+        .group_by(KEYS)
+        .agg(pl.col(TOTALS).sum())
+        .collect()
+    )
+
+
+class AccountingReport:
+    """
+    CPU- and GPU-hours per user, partition and account between `start` and `end`
+    (epoch seconds), read from slurmdbd one `chunk`-second window at a time.
+
+    Every chunk is folded into the running totals as it arrives, so only one
+    chunk's records are ever held in memory. After each chunk the totals and the
+    position are written to `checkpoint` (if given); `AccountingReport.resume()`
+    continues from there after a cancel or a restart. `cancel()` stops the
+    report after the chunk in progress.
+    """
+
+    def __init__(self, start, end, chunk=None, checkpoint=None):
+        self.start = int(start)
+        self.end = int(end)
+        self.chunk = int(chunk or config.REPORT_CHUNK_SECONDS)
+        self.checkpoint = checkpoint
+        self.cursor = self.start
+        self.totals = pl.DataFrame(schema=TOTALS_SCHEMA)
+        self._cancelled = threading.Event()
+
+    @classmethod
+    def resume(cls, checkpoint):
+        """The report saved at `checkpoint`, or None if there is none."""
+        try:
+            with open(checkpoint) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable report checkpoint {checkpoint}: {e}")
+            return None
+        report = cls(state["start"], state["end"], state["chunk"], checkpoint)
+        report.cursor = state["cursor"]
+        report.totals = pl.DataFrame(state["totals"], schema=TOTALS_SCHEMA)
+        return report
+
+    @property
+    def chunks(self) -> int:
+        return math.ceil((self.end - self.start) / self.chunk)
+
+    @property
+    def chunks_done(self) -> int:
+        return math.ceil((self.cursor - self.start) / self.chunk)
+
+    @property
+    def done(self) -> bool:
+        return self.cursor >= self.end
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run_chunk(self) -> bool:
+        """Fetch the next chunk, add it to the totals and checkpoint. Returns whether chunks remain."""
+        if self.done:
+            return False
+        chunk_end = min(self.cursor + self.chunk, self.end)
+        with span("report.chunk"):
+            records = get_slurmdb_jobs(self.cursor, chunk_end)
+            usage = chunk_usage(records, self.cursor, chunk_end)
+            self.totals = pl.concat([self.totals, usage]).group_by(KEYS).agg(pl.col(TOTALS).sum())
+        logger.debug(f"Report chunk {self.chunks_done + 1}/{self.chunks}: {len(records)} jobs")
+        self.cursor = chunk_end
+        self._save()
+        return not self.done
+
+    def run(self, on_chunk=None) -> bool:
+        """Run the remaining chunks until done or cancelled, calling `on_chunk(report)` after each. Returns `done`."""
+        while not self.done and not self.cancelled:
+            self.run_chunk()
+            if on_chunk is not None:
+                on_chunk(self)
+        return self.done
+
+    def _save(self):
+        if not self.checkpoint:
+            return
+        directory = os.path.dirname(self.checkpoint)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        state = {"start": self.start, "end": self.end, "chunk": self.chunk, "cursor": self.cursor,
+                 "totals": self.totals.to_dict(as_series=False)}
+        tmp_path = f"{self.checkpoint}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.checkpoint)
+
+    def discard(self):
+        """Remove the checkpoint, e.g. once the report has been delivered."""
+        if self.checkpoint:
+            try:
+                os.remove(self.checkpoint)
+            except FileNotFoundError:
+                pass
+
+
+def _usernames(users):
+    """uid -> username for the report rows slurmdbd could only name by uid."""
+    directory = get_user_directory()
+    names = {}
+    for user in users:
+        if user.isdigit():
+            account = directory.by_uid(user)
+            if account is not None:
+                names[user] = account.username
+    return names
+
+
+def _day(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+
+def format_report(report: AccountingReport) -> str:
+    totals = report.totals.with_columns(pl.col("user").replace(_usernames(report.totals["user"].unique().to_list())))
+    output = f"Accounting from {_day(report.start)} to {_day(report.end)} UTC"
+    if not report.done:
+        output += f" (partial: {report.chunks_done} of {report.chunks} chunks)"
+    output += ":\n\n"
+    if totals.is_empty():
+        return output + "No jobs ran in this window."
+
+    pretty_column_names = {"user": "User", "partition": "Partition", "account": "Account",
+                           "cpu_hours": "CPU hours", "gpu_hours": "GPU hours", "jobs": "Jobs started"}
+    for key, title in (("user", "By user"), ("partition", "By partition"), ("account", "By account")):
+        by_key = (totals
+            .group_by(key)
+            .agg(pl.col(TOTALS).sum())
+            .sort("cpu_hours", key, descending=[True, False])
+            .with_columns(pl.col("cpu_hours", "gpu_hours").round(1))
+        )
+        output += f"{title}:\n" + render_table(by_key, pretty_column_names) + "\n\n"
+    return output.rstrip("\n")
+
+
+def parse_report_args(text, now=None):
+    """
+    Parse `/report [<n>h|<n>d|<n>w]`, `/report <YYYY-MM-DD> <YYYY-MM-DD>`,
+    `/report cancel` or `/report resume`.
+
+    Returns:
+        tuple: (action: "run", "cancel", "resume" or None if unparseable; start; end), times in epoch seconds.
+    """
+    now = int(time.time() if now is None else now)
+    args = (text or "").split()
+    if args in (["cancel"], ["stop"]):
+        return "cancel", None, None
+    if args == ["resume"]:
+        return "resume", None, None
+    if len(args) == 2:
+        try:
+            start, end = (int(datetime.strptime(arg, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()) for arg in args)
+        except ValueError:
+            return None, None, None
+        # the end date is inclusive
+        end = min(end + 24 * 60 * 60, now)
+        return ("run", start, end) if start < end else (None, None, None)
+    window = parse_duration(args[0] if args else config.REPORT_DEFAULT_WINDOW)
+    if window is None or len(args) > 1 or window.total_seconds() < 1:
+        return None, None, None
+    return "run", now - int(window.total_seconds()), now
+
+
+# slack user id -> the report running for them; one at a time per user
+_running = {}
+_running_lock = threading.Lock()
+
+
+def _checkpoint_path(slack_user_id):
+    return os.path.join(config.REPORT_DIR, f"{slack_user_id}.json")
+
+
+def prepare_report(text, slack_user_id):
+    """
+    Apply `/report` text for `slack_user_id`.
+
+    Returns:
+        tuple: (`AccountingReport` to run, or None; reply text). The caller runs
+        the report and hands it back with `release_report()`.
+    """
+    action, start, end = parse_report_args(text)
+    with _running_lock:
+        running = _running.get(slack_user_id)
+        if action == "cancel":
+            if running is None:
+                return None, "You have no report running."
+            running.cancel()
+            return None, "Cancelling your report after the current chunk; `/report resume` continues it."
+        if action is None:
+            return None, REPORT_USAGE
+        if running is not None:
+            return None, "Your report is still running; `/report cancel` stops it."
+
+        if action == "resume":
+            report = AccountingReport.resume(_checkpoint_path(slack_user_id))
+            if report is None or report.done:
+                return None, "You have no unfinished report to resume."
+        else:
+            report = AccountingReport(start, end, checkpoint=_checkpoint_path(slack_user_id))
+            # resumable even if cancelled before its first chunk
+            report._save()
+        _running[slack_user_id] = report
+    remaining = report.chunks - report.chunks_done
+    return report, (f"Building the accounting report from {_day(report.start)} to {_day(report.end)} UTC "
+                    f"({remaining} chunk{'s' if remaining != 1 else ''} to go). `/report cancel` stops it.")
+
+
+def release_report(slack_user_id, report):
+    """Unregister a report that stopped running; finished reports drop their checkpoint."""
+    with _running_lock:
+        if _running.get(slack_user_id) is report:
+            del _running[slack_user_id]
+    if report.done:
+        report.discard()
@@ -0,0 +1,43 @@
+import polars as pl
+
+from cluster.clusters import get_cluster_names, get_cluster_source
+from cluster.render import render_table
+from cluster.snapshot import estimated_size, get_snapshot_service
+from utils.cache import get_cache_stats
+from utils.trace import get_latency_stats
+
+
+def format_bot_stats() -> str:
+    """Snapshot age, per-stage latency histograms and cache hit counters as text tables."""
+    snapshot = get_snapshot_service().latest()
+    if snapshot is None:
+        output = "Snapshot: not loaded\n\n"
+    else:
+        service = get_snapshot_service()
+        output = (f"Snapshot: v{snapshot.version}, {snapshot.age:.1f} s old, "
+                  f"refreshing every {service.interval:g} s ({service.interval_reason})\n")
+        snapshots = {name: get_cluster_source(name).latest() for name in get_cluster_names()}
+        sizes = ", ".join(f"{name} {s.estimated_size('mb'):.1f} MB" for name, s in snapshots.items() if s is not None)
+        output += f"Snapshot memory: {estimated_size(snapshots.values(), 'mb'):.1f} MB ({sizes})\n\n"
+
+    latencies = get_latency_stats()
+    if latencies:
+        latency_df = pl.DataFrame([{"stage": stage, **stats} for stage, stats in latencies.items()])
+        latency_df = latency_df.with_columns(pl.col("^.*_ms$").round(2))
+        headers = {"stage": "Stage", "count": "Count", "avg_ms": "Avg ms", "p50_ms": "p50 ms", "p95_ms": "p95 ms",
+                   "p99_ms": "p99 ms", "max_ms": "Max ms"}
+        output += "Latency:\n" + render_table(latency_df, headers) + "\n\n"
+
+    caches = get_cache_stats()
+    if caches:
+        cache_df = pl.DataFrame([{"cache": name, **stats} for name, stats in caches.items()])
+        cache_df = cache_df.select(
+            pl.col("cache").str.replace(r"^(cluster|utils)\.", ""),
+            "size", "hits", "stale_hits", "misses", "coalesced", "errors",
+            (pl.col("hit_rate") * 100).round(1),
+            pl.col("load_ms_avg").round(2),
+        )
+        headers = {"cache": "Cache", "size": "Size", "hits": "Hits", "stale_hits": "Stale", "misses": "Misses",
+                   "coalesced": "Coalesced", "errors": "Errors", "hit_rate": "Hit %", "load_ms_avg": "Load ms"}
+        output += "Caches:\n" + render_table(cache_df, headers)
+    return output
@@ -0,0 +1,146 @@
+import os
+import pickle
+import subprocess
+import sys
+import threading
+
+import config
+from cluster.snapshot import get_snapshot_service
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
+ALL_CLUSTERS = "all"
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ClusterWorker:
+    """
+    Keeps the latest snapshot of one extra cluster, fetched by a `cluster.worker`
+    process running with SLURM_CONF=`slurm_conf`.
+
+    Exposes the read side of `SnapshotService` (`running`, `latest()`,
+    `subscribe()`), so callers don't care which cluster they look at. The worker
+    refreshes on its own schedule and a reader thread swaps in every snapshot it
+    sends; a slow or unreachable cluster only leaves its own snapshot stale. A
+    worker that exits is restarted after CLUSTER_WORKER_RESTART_SECONDS.
+    """
+
+    def __init__(self, name, slurm_conf, extra_args=()):
+        self.name = name
+        self.slurm_conf = slurm_conf
+        self.extra_args = list(extra_args)
+        self._snapshot = None
+        self._subscribers = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._process = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def latest(self):
+        return self._snapshot
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def start(self):
+        if self.running:
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"cluster-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._process is not None:
+            self._process.stdin.close()
+            self._process.terminate()
+
+    def _spawn(self):
+        env = dict(os.environ)
+        if self.slurm_conf:
+            env["SLURM_CONF"] = self.slurm_conf
+        return subprocess.Popen(
+            [sys.executable, "-m", "cluster.worker", self.name, *self.extra_args],
+            cwd=_ROOT, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._process = self._spawn()
+            logger.info(f"Started worker for cluster {self.name} (pid {self._process.pid})")
+            try:
+                while True:
+                    snapshot = pickle.load(self._process.stdout)
+                    self._snapshot = snapshot
+                    for callback in self._subscribers:
+                        try:
+                            callback(snapshot)
+                        except Exception as e:
+                            logger.error(f"Snapshot subscriber {getattr(callback, '__qualname__', callback)} failed: {e}")
+            except EOFError:
+                pass
+            except Exception as e:
+                logger.error(f"Lost snapshots from cluster {self.name}: {e}")
+            self._process.kill()
+            self._process.wait()
+            if not self._stop.is_set():
+                logger.error(f"Worker for cluster {self.name} exited with {self._process.returncode}, "
+                             f"restarting in {config.CLUSTER_WORKER_RESTART_SECONDS}s")
+                self._stop.wait(config.CLUSTER_WORKER_RESTART_SECONDS)
+
+
+_workers = {}
+
+
+def start_cluster_workers(clusters=None):
+    """Start one worker per entry of config.CLUSTERS (name -> slurm.conf path)."""
+    clusters = config.CLUSTERS if clusters is None else clusters
+    for name, slurm_conf in clusters.items():
+        if name == config.DEFAULT_CLUSTER:
+            raise ValueError(f"Cluster {name} is the in-process default cluster; rename it in config.CLUSTERS")
+        _workers[name] = ClusterWorker(name, slurm_conf).start()
+    return _workers
+
+
+def get_cluster_names():
+    return [config.DEFAULT_CLUSTER, *_workers]
+
+
+def get_cluster_source(cluster=None):
+    """The snapshot service (default cluster) or worker for `cluster`, or None if it isn't configured."""
+    if cluster is None or cluster == config.DEFAULT_CLUSTER:
+        return get_snapshot_service()
+    return _workers.get(cluster)
+
+
+def parse_cluster_args(text):
+    """
+    Split a squeue-style cluster selector off command text:
+    `-M <name>`, `-M<name>`, `--clusters <name>` or `--clusters=<name>`.
+
+    Returns:
+        tuple: (cluster name, `ALL_CLUSTERS` or None; the remaining text)
+    """
+    tokens = (text or "").split()
+    cluster = None
+    rest = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ("-M", "--clusters") and i + 1 < len(tokens):
+            cluster = tokens[i + 1]
+            i += 2
+            continue
+        if token.startswith("--clusters="):
+            cluster = token.split("=", 1)[1]
+        elif token.startswith("-M") and len(token) > 2:
+            cluster = token[2:]
+        else:
+            rest.append(token)
+        i += 1
+    return cluster, " ".join(rest)
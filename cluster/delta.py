@@ -0,0 +1,189 @@
+import threading
+from collections import defaultdict
+
+import polars as pl
+
+import config
+from utils.log import get_logger
+from utils.utils import get_user_directory
+
+logger = get_logger(__name__)
+
+FAILED_STATES = ["FAILED", "CANCELLED", "TIMEOUT", "OUT_OF_MEMORY", "NODE_FAIL", "BOOT_FAIL", "DEADLINE", "PREEMPTED"]
+# events after which a job can't change any more, so job watches are dropped
+FINAL_EVENTS = {"completed", "failed", "removed"}
+_EVENT_COLUMNS = ["id", "user_id", "name", "partition", "old_state", "new_state", "event"]
+
+
+def diff_jobs(old_df: pl.DataFrame, new_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Job events between two job snapshots, keyed by job id, from one outer join.
+
+    Events: "new" (first seen), "started", "completed", "failed", "state_changed"
+    (any other transition) and "removed" (no longer reported by slurmctld).
+    Unchanged jobs produce no rows.
+    """
+    columns = ["id", "user_id", "name", "partition", "job_state"]
+    if new_df.width == 0:
+        return pl.DataFrame(schema={col: pl.Utf8 for col in _EVENT_COLUMNS})
+    new = new_df.select(columns)
+    old = new.clear() if old_df is None or old_df.width == 0 else old_df.select(columns)
+
+    # compared on the snapshots' own dtypes; only the changed rows are turned into strings
+    joined = old.join(new, on="id", how="full", coalesce=True, suffix="_new")
+    old_state, new_state = pl.col("job_state"), pl.col("job_state_new")
+
+    return (joined
+        .filter(old_state.is_null() | new_state.is_null() | (old_state != new_state))
+        .select(
+            pl.col("id").cast(pl.Utf8),
+            pl.coalesce("user_id_new", "user_id").cast(pl.Utf8).alias("user_id"),
+            pl.coalesce("name_new", "name").alias("name"),
+            pl.coalesce("partition_new", "partition").cast(pl.Utf8).alias("partition"),
+            old_state.cast(pl.Utf8).alias("old_state"),
+            new_state.cast(pl.Utf8).alias("new_state"),
+            pl.when(old_state.is_null()).then(pl.lit("new"))
+                .when(new_state.is_null()).then(pl.lit("removed"))
+                .when(new_state == "RUNNING").then(pl.lit("started"))
+                .when(new_state == "COMPLETED").then(pl.lit("completed"))
+                .when(new_state.is_in(FAILED_STATES)).then(pl.lit("failed"))
+                .otherwise(pl.lit("state_changed"))
+                .alias("event"),
+        )
+    )
+
+
+def _describe(event):
+    if event["event"] == "new":
+        return f"`{event['id']}` {event['name']} submitted to {event['partition']} ({event['new_state']})"
+    if event["event"] == "removed":
+        return f"`{event['id']}` {event['name']} left the queue (last seen {event['old_state']})"
+    return f"`{event['id']}` {event['name']} {event['old_state']} -> {event['new_state']}"
+
+
+class JobWatcher:
+    """
+    Turns consecutive snapshots into job events and delivers them to `/watch` subscribers.
+
+    Subscriptions are indexed by job id and by Unix uid, so each event costs
+    two dict lookups no matter how many people watch. All events for one
+    subscriber in a refresh are sent as a single batched message through
+    `notify(channel_id, slack_user_id, text)`.
+    """
+
+    def __init__(self, notify=None):
+        self.notify = notify
+        self._lock = threading.Lock()
+        # key -> {(channel_id, slack_user_id)}
+        self._by_job = defaultdict(set)
+        self._by_user = defaultdict(set)
+        self._previous = None
+
+    def watch_job(self, job_id, channel_id, slack_user_id):
+        with self._lock:
+            self._by_job[str(job_id)].add((channel_id, slack_user_id))
+
+    def watch_user(self, unix_uid, channel_id, slack_user_id):
+        with self._lock:
+            self._by_user[str(unix_uid)].add((channel_id, slack_user_id))
+
+    def unwatch(self, key, slack_user_id, kind):
+        """Drop `slack_user_id`'s watches on job id (`kind` "job") or uid ("user") `key`. Returns how many were removed."""
+        index = self._by_job if kind == "job" else self._by_user
+        with self._lock:
+            subscribers = index.get(str(key), set())
+            matching = {s for s in subscribers if s[1] == slack_user_id}
+            subscribers -= matching
+            if not subscribers:
+                index.pop(str(key), None)
+        return len(matching)
+
+    def watches(self, slack_user_id):
+        with self._lock:
+            jobs = sorted(k for k, subs in self._by_job.items() if any(s[1] == slack_user_id for s in subs))
+            users = sorted(k for k, subs in self._by_user.items() if any(s[1] == slack_user_id for s in subs))
+        return jobs, users
+
+    def on_snapshot(self, snapshot):
+        """Snapshot subscriber: diff against the previous snapshot and notify watchers."""
+        previous, self._previous = self._previous, snapshot
+        if previous is None or snapshot.version <= previous.version or snapshot.job_df is previous.job_df:
+            return
+        with self._lock:
+            if not self._by_job and not self._by_user:
+                return
+        events = diff_jobs(previous.job_df, snapshot.job_df)
+        if not events.is_empty():
+            self.dispatch(events)
+
+    def dispatch(self, events: pl.DataFrame):
+        batches = defaultdict(list)
+        with self._lock:
+            watched = events.filter(pl.col("id").is_in(list(self._by_job)) | pl.col("user_id").is_in(list(self._by_user)))
+            for event in watched.iter_rows(named=True):
+                subscribers = self._by_job.get(event["id"], set()) | self._by_user.get(event["user_id"], set())
+                for subscriber in subscribers:
+                    batches[subscriber].append(event)
+                if event["event"] in FINAL_EVENTS:
+                    self._by_job.pop(event["id"], None)
+
+        for (channel_id, slack_user_id), batch in batches.items():
+            lines = [f"• {_describe(event)}" for event in batch[:config.WATCH_MAX_EVENTS_PER_MESSAGE]]
+            if len(batch) > config.WATCH_MAX_EVENTS_PER_MESSAGE:
+                lines.append(f"… and {len(batch) - config.WATCH_MAX_EVENTS_PER_MESSAGE} more")
+            text = f"<@{slack_user_id}> job updates:\n" + "\n".join(lines)
+            try:
+                self.notify(channel_id, slack_user_id, text)
+            except Exception as e:
+                logger.error(f"Could not deliver job updates to {slack_user_id}: {e}")
+        if batches:
+            logger.info(f"Delivered {len(watched)} job events to {len(batches)} watchers")
+
+
+_watcher = JobWatcher()
+
+
+def get_job_watcher() -> JobWatcher:
+    return _watcher
+
+
+WATCH_USAGE = "Usage: `/watch <jobid|username>`, `/watch stop <jobid|username>` or `/watch` to list your watches."
+
+
+def handle_watch(text, channel_id, slack_user_id, watcher=None):
+    """Apply a `/watch` command and return the reply text."""
+    watcher = watcher or get_job_watcher()
+    args = (text or "").split()
+    stop = bool(args) and args[0] in ("stop", "off")
+    if stop:
+        args = args[1:]
+
+    if not args:
+        if stop:
+            return WATCH_USAGE
+        jobs, uids = watcher.watches(slack_user_id)
+        if not jobs and not uids:
+            return f"You are not watching anything. {WATCH_USAGE}"
+        users = get_user_directory()
+        names = [getattr(users.by_uid(uid), "username", uid) for uid in uids]
+        return f"Watching jobs: {', '.join(jobs) or '-'}; users: {', '.join(names) or '-'}"
+    if len(args) > 1:
+        return WATCH_USAGE
+
+    target = args[0]
+    if target.isdigit():
+        key, kind = target, "job"
+    else:
+        user = get_user_directory().by_username(target)
+        if user is None:
+            return f"Could not find a Unix account for {target}."
+        key, kind = user.unix_uid, "user"
+
+    if stop:
+        removed = watcher.unwatch(key, slack_user_id, kind)
+        return f"Stopped watching {target}." if removed else f"You were not watching {target}."
+    if kind == "job":
+        watcher.watch_job(key, channel_id, slack_user_id)
+    else:
+        watcher.watch_user(key, channel_id, slack_user_id)
+    return f"Watching {kind} {target}; updates will be posted here."
@@ -0,0 +1,198 @@
+import json
+import os
+import re
+import time
+
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "notebooks")
+
+# Offset added to job ids of each synthetic replica so scaled-up queues never collide.
+_JOB_ID_STRIDE = 10_000_000
+_DAY = 24 * 60 * 60
+# Offset added to job ids of each daily replay of the slurmdbd history, above every replica's ids.
+_DB_JOB_ID_STRIDE = 10_000_000_000
+
+
+def _scale_nodes(nodes, factor):
+    if factor <= 1:
+        return nodes
+    scaled = dict(nodes)
+    for replica in range(1, factor):
+        for name, node in nodes.items():
+            copy = dict(node, name=f"{name}-{replica}", node_addr=f"{name}-{replica}", node_hostname=f"{name}-{replica}")
+            scaled[copy["name"]] = copy
+    return scaled
+
+
+def _scale_jobs(jobs, factor):
+    if factor <= 1:
+        return jobs
+    scaled = dict(jobs)
+    for replica in range(1, factor):
+        offset = replica * _JOB_ID_STRIDE
+        for job_id, job in jobs.items():
+            copy = dict(job, job_id=job_id + offset)
+            if copy.get("array_job_id") is not None:
+                copy["array_job_id"] += offset
+            scaled[job_id + offset] = copy
+    return scaled
+
+
+def _db_records(jobs):
+    """
+    slurmdbd-style accounting records of the fixture jobs that have started.
+    Fixture jobs carry no account, so one is derived from the uid, and their
+    tres_alloc_str has no GPUs, so the GPU count comes from tres_per_node.
+    """
+    records = []
+    for job_id, job in jobs.items():
+        if not job.get("start_time") or job.get("job_state") == "PENDING":
+            continue
+        gpus = re.search(r"gpu(?::[^:,]+)?:(\d+)", job.get("tres_per_node") or "")
+        tres = f"1={job.get('num_cpus') or 0},4={job.get('num_nodes') or 0}" + (f",1001={gpus.group(1)}" if gpus else "")
+        records.append({
+            "jobid": job_id,
+            "user": None,
+            "uid": job.get("user_id"),
+            "account": job.get("account") or f"group{job.get('user_id', 0) // 1000}",
+            "partition": job.get("partition"),
+            "start": job["start_time"],
+            "duration": job.get("run_time") or 0,
+            "running": job.get("job_state") == "RUNNING",
+            "tres_alloc_str": tres,
+        })
+    return records
+
+
+class _Query:
+    """Mimics the `pyslurm.node()`/`pyslurm.job()`/... query objects."""
+
+    def __init__(self, source, kind):
+        self._source = source
+        self._kind = kind
+
+    def get(self):
+        return self._source._fetch(self._kind)
+
+
+class _JobQuery(_Query):
+
+    def find_user(self, user):
+        # pyslurm resolves usernames to uids; fixtures only carry uids
+        return {job_id: job for job_id, job in self.get().items() if job.get("user_id") == int(user)}
+
+
+class _DbJobQuery:
+    """Mimics `pyslurm.slurmdb_jobs()`."""
+
+    def __init__(self, source):
+        self._source = source
+
+    def get(self, jobids=None, userids=None, starttime=0, endtime=0, **kwargs):
+        return self._source._fetch_db(starttime, endtime)
+
+
+class FixtureSlurm:
+    """
+    Stand-in for the pyslurm module backed by the JSON captures in `notebooks/`.
+
+    Plug it in with `cluster.query_slurm.set_slurm_source(FixtureSlurm())`.
+    Every `get()` decodes a fresh copy of the payload, like a real RPC would,
+    and the time spent there is accumulated in `fetch_seconds` so callers can
+    separate fetch cost from transform cost.
+
+    Args:
+        fixture_dir (str): directory holding node.json, jobs.json and statistics.json.
+        node_scale (int): replicate every node this many times (renamed `<name>-<i>`).
+        job_scale (int): replicate every job this many times (with shifted job ids).
+        latency (float): seconds to sleep per query, to emulate a slow slurmctld.
+        version (str): value returned by `version()`.
+        history_days (int): days of slurmdbd history behind `slurmdb_jobs()`: the
+            started jobs replayed once a day, the latest replay ending now.
+    """
+
+    def __init__(self, fixture_dir=FIXTURE_DIR, node_scale=1, job_scale=1, latency=0.0, version="21.08.8", history_days=90):
+        with open(os.path.join(fixture_dir, "node.json")) as f:
+            nodes = json.load(f)
+        with open(os.path.join(fixture_dir, "jobs.json")) as f:
+            # pyslurm keys jobs by integer id; JSON can only store string keys
+            jobs = {int(k): v for k, v in json.load(f).items()}
+        with open(os.path.join(fixture_dir, "statistics.json")) as f:
+            statistics = json.load(f)
+
+        nodes = _scale_nodes(nodes, node_scale)
+        jobs = _scale_jobs(jobs, job_scale)
+        self.num_nodes = len(nodes)
+        self.num_jobs = len(jobs)
+        self._payloads = {
+            "node": json.dumps(nodes),
+            "job": json.dumps(jobs),
+            "statistics": json.dumps(statistics),
+        }
+        self._latency = latency
+        self._version = version
+        self._db_records = _db_records(jobs)
+        self._history_days = history_days
+        # shifts the replays so the newest job starts now
+        self._db_shift = int(time.time()) - max((r["start"] for r in self._db_records), default=0)
+        self.fetch_seconds = {kind: 0.0 for kind in (*self._payloads, "slurmdb")}
+        self.fetch_count = {kind: 0 for kind in (*self._payloads, "slurmdb")}
+        logger.debug(f"Loaded fixtures from {fixture_dir}: {self.num_nodes} nodes, {self.num_jobs} jobs")
+
+    def _fetch(self, kind):
+        start = time.perf_counter()
+        if self._latency:
+            time.sleep(self._latency)
+        payload = json.loads(self._payloads[kind])
+        if kind == "job":
+            payload = {int(k): v for k, v in payload.items()}
+        self.fetch_seconds[kind] += time.perf_counter() - start
+        self.fetch_count[kind] += 1
+        return payload
+
+    def _fetch_db(self, starttime, endtime):
+        start = time.perf_counter()
+        if self._latency:
+            time.sleep(self._latency)
+        jobs = {}
+        for day in range(self._history_days):
+            offset = self._db_shift - day * _DAY
+            for record in self._db_records:
+                job_start = record["start"] + offset
+                job_end = job_start + record["duration"]
+                if job_start >= endtime or job_end <= starttime:
+                    continue
+                job_id = record["jobid"] + day * _DB_JOB_ID_STRIDE
+                # only the latest replay is still running; slurmdbd reports end 0 for those
+                running = record["running"] and day == 0
+                jobs[job_id] = {
+                    "jobid": job_id, "user": record["user"], "uid": record["uid"], "account": record["account"],
+                    "partition": record["partition"], "start": job_start, "end": 0 if running else job_end,
+                    "elapsed": record["duration"], "tres_alloc_str": record["tres_alloc_str"],
+                }
+        self.fetch_seconds["slurmdb"] += time.perf_counter() - start
+        self.fetch_count["slurmdb"] += 1
+        return jobs
+
+    def reset_counters(self):
+        for kind in self.fetch_seconds:
+            self.fetch_seconds[kind] = 0.0
+            self.fetch_count[kind] = 0
+
+    def node(self):
+        return _Query(self, "node")
+
+    def job(self):
+        return _JobQuery(self, "job")
+
+    def statistics(self):
+        return _Query(self, "statistics")
+
+    def slurmdb_jobs(self):
+        return _DbJobQuery(self)
+
+    def version(self):
+        return self._version
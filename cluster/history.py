@@ -0,0 +1,219 @@
+import glob
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import polars as pl
+
+import config
+from cluster.render import render_table
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
+UTILIZATION = "utilization"
+JOBS = "jobs"
+_COMPACTED_PREFIX = "compacted-"
+_DURATION = re.compile(r"^(\d+)([hdw])$")
+_DURATION_UNITS = {"h": "hours", "d": "days", "w": "weeks"}
+
+
+class HistoryStore:
+    """
+    Append-only cluster history kept as hive-partitioned Parquet:
+
+        <root>/utilization/date=YYYY-MM-DD/part-*.parquet   one row per partition per sample
+        <root>/jobs/date=YYYY-MM-DD/part-*.parquet          one row per job per sample
+
+    Every sample is written as its own small file; `compact()` merges the
+    small files of a day into one. Queries go through `pl.scan_parquet`, so the
+    `date` partition prunes whole directories and only the requested columns
+    are read.
+    """
+
+    def __init__(self, root=None, utilization_interval=None, job_interval=None):
+        self.root = root or config.HISTORY_DIR
+        self.utilization_interval = config.HISTORY_UTILIZATION_INTERVAL if utilization_interval is None else utilization_interval
+        self.job_interval = config.HISTORY_JOB_INTERVAL if job_interval is None else job_interval
+        self._last_written = {UTILIZATION: 0.0, JOBS: 0.0}
+        # held while files are listed/read and while compaction swaps files
+        self._files_lock = threading.RLock()
+        self._compactor = None
+        self._stop = threading.Event()
+
+    def _dataset_glob(self, dataset):
+        return os.path.join(self.root, dataset, "date=*", "*.parquet")
+
+    def _write(self, dataset, df, taken_at):
+        day = datetime.fromtimestamp(taken_at, tz=timezone.utc).strftime("%Y-%m-%d")
+        directory = os.path.join(self.root, dataset, f"date={day}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{int(taken_at * 1000)}.parquet")
+        df.write_parquet(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+    def record(self, snapshot):
+        """Snapshot subscriber: append utilization and job rows when their sampling interval has passed."""
+        taken_at = snapshot.taken_at
+        timestamp = pl.lit(datetime.fromtimestamp(taken_at, tz=timezone.utc).replace(tzinfo=None)).alias("timestamp")
+
+        if taken_at - self._last_written[UTILIZATION] >= self.utilization_interval and not snapshot.partition_df.is_empty():
+            utilization = snapshot.partition_df.select(
+                timestamp,
+                pl.col("partitions").cast(pl.Utf8).alias("partition"),
+                pl.col("name").list.len().cast(pl.Int64).alias("nodes"),
+                pl.col("cpus", "alloc_cpus", "gres", "gres_used").cast(pl.Int64),
+                pl.col("real_memory", "free_mem").cast(pl.Float64),
+            )
+            self._write(UTILIZATION, utilization, taken_at)
+            self._last_written[UTILIZATION] = taken_at
+
+        if taken_at - self._last_written[JOBS] >= self.job_interval and not snapshot.job_df.is_empty():
+            jobs = snapshot.job_df.select(
+                timestamp,
+                pl.col("id").cast(pl.Utf8),
+                pl.col("user_id").cast(pl.Utf8),
+                pl.col("partition", "job_state").cast(pl.Utf8),
+                pl.col("num_nodes", "run_time").cast(pl.Int64),
+            )
+            self._write(JOBS, jobs, taken_at)
+            self._last_written[JOBS] = taken_at
+
+    def scan(self, dataset, start, end):
+        """Lazy frame over `dataset` rows with start <= timestamp < end (naive UTC datetimes)."""
+        pattern = self._dataset_glob(dataset)
+        if not glob.glob(pattern):
+            return None
+        return (pl.scan_parquet(pattern, hive_partitioning=True)
+            .filter(pl.col("date").is_between(start.date(), end.date()))
+            .filter((pl.col("timestamp") >= start) & (pl.col("timestamp") < end))
+        )
+
+    def query(self, dataset, start, end, build):
+        """Collect `build(scan(dataset, start, end))`, or return None when there is no history yet."""
+        with self._files_lock:
+            lf = self.scan(dataset, start, end)
+            return None if lf is None else build(lf).collect()
+
+    def compact(self, min_files=None):
+        """Merge the per-sample files of every day that has at least `min_files` of them into one file."""
+        min_files = config.HISTORY_COMPACT_MIN_FILES if min_files is None else min_files
+        for dataset in (UTILIZATION, JOBS):
+            for directory in sorted(glob.glob(os.path.join(self.root, dataset, "date=*"))):
+                parts = sorted(glob.glob(os.path.join(directory, "part-*.parquet")))
+                if len(parts) < min_files:
+                    continue
+                existing = glob.glob(os.path.join(directory, f"{_COMPACTED_PREFIX}*.parquet"))
+                merged = pl.concat([pl.read_parquet(path) for path in existing + parts], how="vertical_relaxed").sort("timestamp")
+                target = os.path.join(directory, f"{_COMPACTED_PREFIX}{int(time.time() * 1000)}.parquet")
+                merged.write_parquet(f"{target}.tmp")
+                with self._files_lock:
+                    os.replace(f"{target}.tmp", target)
+                    for path in existing + parts:
+                        os.remove(path)
+                logger.info(f"Compacted {len(existing) + len(parts)} files in {directory} into {len(merged)} rows")
+
+    def start_compactor(self, interval=None):
+        interval = config.HISTORY_COMPACT_INTERVAL if interval is None else interval
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.compact()
+                except Exception as e:
+                    logger.error(f"History compaction failed: {e}")
+
+        self._stop.clear()
+        self._compactor = threading.Thread(target=run, name="history-compactor", daemon=True)
+        self._compactor.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+_store = None
+
+
+def get_history_store():
+    global _store
+    if _store is None:
+        _store = HistoryStore()
+    return _store
+
+
+def parse_usage_args(text):
+    """
+    Parse `/usage [partition] [<n>h|<n>d|<n>w]`, e.g. `/usage gpu 7d`.
+
+    Returns:
+        tuple: (partition or None, timedelta); the window defaults to config.USAGE_DEFAULT_WINDOW.
+    """
+    partition = None
+    window = parse_duration(config.USAGE_DEFAULT_WINDOW)
+    for token in (text or "").split():
+        duration = parse_duration(token)
+        if duration is not None:
+            window = duration
+        else:
+            partition = token
+    return partition, window
+
+
+def parse_duration(token):
+    match = _DURATION.match(token.lower())
+    if match is None:
+        return None
+    return timedelta(**{_DURATION_UNITS[match.group(2)]: int(match.group(1))})
+
+
+def _percent_of(used, total):
+    return pl.when(total > 0).then((used / total * 100).round(2)).otherwise(None)
+
+
+def get_usage_report(partition=None, window=timedelta(days=7), store=None):
+    store = store or get_history_store()
+    end = datetime.now(timezone.utc).replace(tzinfo=None)
+    start = end - window
+
+    def utilization(lf):
+        if partition:
+            lf = lf.filter(pl.col("partition") == partition)
+        return (lf
+            .select("partition", "cpus", "alloc_cpus", "gres", "gres_used", "real_memory", "free_mem")
+            .with_columns(
+                _percent_of(pl.col("alloc_cpus"), pl.col("cpus")).alias("cpu"),
+                _percent_of(pl.col("gres_used"), pl.col("gres")).alias("gpu"),
+                _percent_of(pl.col("real_memory") - pl.col("free_mem"), pl.col("real_memory")).alias("mem"),
+            )
+            .group_by("partition")
+            .agg(
+                pl.len().alias("samples"),
+                pl.col("cpu").mean().round(2).alias("avg_cpu"),
+                pl.col("cpu").max().alias("peak_cpu"),
+                pl.col("gpu").mean().round(2).alias("avg_gpu"),
+                pl.col("gpu").max().alias("peak_gpu"),
+                pl.col("mem").mean().round(2).alias("avg_mem"),
+            )
+            .sort("partition")
+        )
+
+    def jobs(lf):
+        if partition:
+            lf = lf.filter(pl.col("partition") == partition)
+        return lf.group_by("partition").agg(pl.col("id").n_unique().alias("jobs"), pl.col("user_id").n_unique().alias("users"))
+
+    usage_df = store.query(UTILIZATION, start, end, utilization)
+    if usage_df is None or usage_df.is_empty():
+        return f"No usage history{f' for {partition}' if partition else ''} in the last {window}."
+    job_df = store.query(JOBS, start, end, jobs)
+    if job_df is not None:
+        usage_df = usage_df.join(job_df, on="partition", how="left")
+
+    pretty_column_names = {"partition": "Partition", "samples": "Samples", "avg_cpu": "Avg CPU %", "peak_cpu": "Peak CPU %",
+                           "avg_gpu": "Avg GPU %", "peak_gpu": "Peak GPU %", "avg_mem": "Avg RAM %", "jobs": "Jobs", "users": "Users"}
+    output = f"Usage since {start:%Y-%m-%d %H:%M} UTC:\n\n"
+    output += render_table(usage_df, pretty_column_names)
+    return output
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import polars as pl
+
+from cluster.snapshot import get_snapshot_service
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (metric, help, partition_df column)
+PARTITION_METRICS = [
+    ("slurm_partition_cpus_total", "CPUs in the partition.", "cpus"),
+    ("slurm_partition_cpus_alloc", "Allocated CPUs in the partition.", "alloc_cpus"),
+    ("slurm_partition_memory_gigabytes_total", "Real memory in the partition (GB).", "real_memory"),
+    ("slurm_partition_memory_gigabytes_free", "Free memory in the partition (GB).", "free_mem"),
+    ("slurm_partition_gpus_total", "GPUs in the partition.", "gres"),
+    ("slurm_partition_gpus_alloc", "Allocated GPUs in the partition.", "gres_used"),
+]
+
+_lock = threading.Lock()
+# (snapshot version, rendered body without the age/interval gauges); scrapes between refreshes reuse the body
+_rendered = (None, "")
+
+
+def _label(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _family(name, help_text, samples, metric_type="gauge"):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{_label(val)}"' for key, val in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return lines
+
+
+def _render(snapshot) -> str:
+    lines = []
+    partition_df = snapshot.partition_df
+    if partition_df.width:
+        partitions = partition_df.with_columns(pl.col("name").list.len().alias("nodes")).to_dicts()
+        lines += _family("slurm_partition_nodes", "Nodes in the partition.",
+                         [({"partition": row["partitions"]}, row["nodes"]) for row in partitions])
+        for name, help_text, column in PARTITION_METRICS:
+            lines += _family(name, help_text, [({"partition": row["partitions"]}, row[column]) for row in partitions])
+
+    job_df = snapshot.job_df
+    if job_df.width:
+        counts = job_df.group_by("partition", "job_state").len().sort("partition", "job_state")
+        lines += _family("slurm_jobs", "Jobs by partition and state.",
+                         [({"partition": partition, "state": state}, count) for partition, state, count in counts.iter_rows()])
+
+    lines += _family("slurm_snapshot_version", "Version of the snapshot these metrics come from.", [({}, snapshot.version)])
+    lines += _family("slurm_snapshot_timestamp_seconds", "Unix time the snapshot was taken.", [({}, f"{snapshot.taken_at:.3f}")])
+    return "\n".join(lines) + "\n"
+
+
+def format_prometheus_metrics() -> str:
+    """
+    Partition allocation and job-state counts of the latest snapshot in the
+    Prometheus text exposition format. Never queries slurmctld; scrapes only
+    read what the snapshot service already fetched.
+    """
+    global _rendered
+    snapshot = get_snapshot_service().latest()
+    if snapshot is None:
+        return ""
+    with _lock:
+        version, body = _rendered
+        if version != snapshot.version:
+            body = _render(snapshot)
+            _rendered = (snapshot.version, body)
+    live = _family("slurm_snapshot_age_seconds", "Seconds since the snapshot was taken.", [({}, f"{time.time() - snapshot.taken_at:.3f}")])
+    live += _family("slurm_snapshot_refresh_interval_seconds", "Current adaptive snapshot refresh interval.",
+                    [({}, get_snapshot_service().interval)])
+    return body + "\n".join(live) + "\n"
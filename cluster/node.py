@@ -1,61 +1,142 @@
 import polars as pl
-from prettytable import PrettyTable
 
-from cluster.query_slurm import get_slurm_node_df, get_slurm_job_df
+import config
+from cluster.clusters import ALL_CLUSTERS, get_cluster_names, get_cluster_source
+from cluster.query_slurm import (collapse_job_arrays, format_job_columns, format_partition_df, get_slurm_node_state_df,
+                                 get_slurm_partition_df, get_slurm_user_job_df)
+from cluster.render import render_table
+from cluster.snapshot import get_snapshot_service
+from cluster.topology import get_topology_png
 from utils.log import get_logger
-from utils.utils import _get_users
+from utils.trace import span
+from utils.utils import get_user_directory
 
 logger = get_logger(__name__)
 
-def get_node_info():
-    node_df = get_slurm_node_df()
-    if node_df.is_empty():
+SNAPSHOT_LOADING = "Cluster data is still loading, please try again in a moment."
+# squeue's flag for one row per array task, plus a spelled-out alias
+SQUEUE_EXPAND_FLAGS = ("-r", "--array", "--expand")
+
+def _is_default(cluster):
+    return cluster is None or cluster == config.DEFAULT_CLUSTER
+
+def _unknown_cluster(cluster):
+    """Reply for a cluster selector that names no configured cluster, else None."""
+    if cluster == ALL_CLUSTERS or get_cluster_source(cluster) is not None:
+        return None
+    return f"Unknown cluster {cluster}. Known clusters: {', '.join(get_cluster_names())}, {ALL_CLUSTERS}."
+
+def _snapshot_frame(attr, fallback, cluster=None):
+    """
+    Frame `attr` of the latest background snapshot of `cluster`, never blocking
+    on pyslurm. Returns None until the first snapshot is published. Without a
+    running snapshot service (scripts, notebooks) the default cluster is
+    queried through `fallback`.
+    """
+    source = get_cluster_source(cluster)
+    if not source.running:
+        return fallback() if _is_default(cluster) else None
+    snapshot = source.latest()
+    return None if snapshot is None else getattr(snapshot, attr)
+
+def get_node_info(cluster=None):
+    error = _unknown_cluster(cluster)
+    if error:
+        return error
+    if cluster == ALL_CLUSTERS:
+        return "\n\n".join(f"Cluster {name}:\n{get_node_info(name)}" for name in get_cluster_names())
+
+    partition_df = _snapshot_frame("partition_df", get_slurm_partition_df, cluster)
+    if partition_df is None:
+        return SNAPSHOT_LOADING
+    if partition_df.is_empty():
         logger.warning("No Nodes found!")
         return "No nodes found."
-    
+
+    return format_node_info(partition_df)
+
+def get_topology():
+    """PNG bytes of the partition/node usage graph, or a text message when there is nothing to draw."""
+    node_state_df = _snapshot_frame("node_state_df", get_slurm_node_state_df)
+    if node_state_df is None:
+        return SNAPSHOT_LOADING
+    if node_state_df.is_empty():
+        logger.warning("No Nodes found!")
+        return "No nodes found."
+    return get_topology_png(node_state_df)
+
+def format_node_info(partition_df: pl.DataFrame) -> str:
     pretty_column_names = {"partitions": "Partitions", "cpus": "CPUs", "cpus_usage": "CPU usage", "real_memory": "RAM", "mem_usage": "RAM usage", "gres": "GPUs", "gres_usage": "GPU usage"}
     
-    node_df_selection = node_df.select("partitions", "cpus", "cpus_usage", "real_memory", "mem_usage", "gres", "gres_usage")
+    node_df_selection = format_partition_df(partition_df).select("partitions", "cpus", "cpus_usage", "real_memory", "mem_usage", "gres", "gres_usage")
     
-    table = PrettyTable()
-    table.field_names = [pretty_column_names.get(col) for col in node_df_selection.columns]
-    for row in node_df_selection.iter_rows():
-        table.add_row(list(row))
-
     output = "Slurm Node Information:\n\n"
-    output += table.get_string()
+    output += render_table(node_df_selection, pretty_column_names)
     
     return output
 
-def get_squeue(real_name: str, username: str = None) -> str:
-    USERS = _get_users()
-    
-    job_df = get_slurm_job_df()
+def _user_job_frame(unix_uid, cluster=None):
+    """
+    Jobs for one user: filtered from the shared snapshot while it is fresh
+    (older snapshots are accepted while refreshes back off from a busy
+    slurmctld), otherwise fetched for just this user from slurmctld. A stale snapshot is
+    still used if that query fails. Other clusters are only served from their
+    worker's snapshot; None until it has sent one.
+    """
+    if not _is_default(cluster):
+        return _snapshot_frame("job_df", None, cluster)
+
+    service = get_snapshot_service()
+    snapshot = service.latest() if service.running else None
+    if snapshot is not None and snapshot.age <= service.max_snapshot_age:
+        return snapshot.job_df
+
+    job_df = get_slurm_user_job_df(unix_uid)
+    if job_df.width == 0 and snapshot is not None:
+        logger.warning(f"Per-user job query failed, using the {snapshot.age:.0f}s old snapshot")
+        return snapshot.job_df
+    return job_df
+
+def parse_squeue_flags(text):
+    """Split the array expansion flag off `/squeue` text: (remaining text, expand)."""
+    tokens = (text or "").split()
+    rest = [token for token in tokens if token not in SQUEUE_EXPAND_FLAGS]
+    return " ".join(rest), len(rest) != len(tokens)
+
+def get_squeue(real_name: str, username: str = None, cluster: str = None, expand: bool = False) -> str:
+    error = _unknown_cluster(cluster)
+    if error:
+        return error
+    if cluster == ALL_CLUSTERS:
+        return "\n\n".join(f"Cluster {name}:\n{get_squeue(real_name, username, name, expand)}" for name in get_cluster_names())
+
+    with span("user_resolution.unix"):
+        users = get_user_directory()
+        user = users.by_username(username) if username else users.by_real_name(real_name)
+    if user is None:
+        logger.warning(f"No Unix account found for {username or real_name}")
+        return f"Could not find a Unix account for {username or real_name}."
+
+    job_df = _user_job_frame(user.unix_uid, cluster)
+    if job_df is None:
+        return SNAPSHOT_LOADING
     if job_df.is_empty():
-        logger.warning(f"No Jobs found for {real_name}!")
-        return f"No Jobs found for {real_name}."
-    
-    if username:
-        for user in USERS:
-            if user.username == username:
-                unix_uid = user.unix_uid
-    else:
-        for user in USERS:
-            if user.real_name == real_name:
-                unix_uid = user.unix_uid
-                username = user.username
-            
+        logger.warning(f"No Jobs found for {user.username}!")
+        return f"No Jobs found for {user.username}."
+
+    return format_squeue(job_df, user.unix_uid, user.username, expand)
+
+def format_squeue(job_df: pl.DataFrame, unix_uid: str, username: str, expand: bool = False) -> str:
+    """The user's jobs as a table, with each job array collapsed into one row unless `expand`."""
     pretty_column_names = {"id": "Job ID", "name": "Job Name", "partition": "Partition", "nodes": "Nodes", "num_nodes": "Num Nodes", "job_state": "State", "run_time_str": "Run Time", "username": "Username"}
     
-    job_df = job_df.filter(pl.col("user_id") == unix_uid)
-    job_df = job_df.with_columns(pl.col("user_id").replace(unix_uid, username).alias("username"))
-    table = PrettyTable()
-    table.field_names = [pretty_column_names.get(col) for col in job_df.columns]
-    for row in job_df.iter_rows():
-        table.add_row(list(row))
-        
+    job_df = job_df.filter(pl.col("user_id") == int(unix_uid))
+    if not expand:
+        job_df = collapse_job_arrays(job_df)
+    job_df = format_job_columns(job_df).select("id", "name", "partition", "nodes", "num_nodes", "job_state", "run_time_str", pl.lit(username).alias("username"))
+
     output = "Squeue:\n\n"
-    output += table.get_string()
+    output += render_table(job_df, pretty_column_names)
     
     return output
     
@@ -1,103 +1,414 @@
-import pyslurm
 import polars as pl
 import json
-from datetime import datetime
 
+import config
+from utils.cache import ttl_cache
 from utils.log import get_logger
-from utils.utils import cache_for_n_seconds, _format_time
+from utils.trace import span
 
 logger = get_logger(__name__)
 
-@cache_for_n_seconds(seconds=2)
-def get_slurm_node_df():
-    try:
-        json_string = json.dumps(pyslurm.node().get())
-        json_object = json.loads(json_string)
-        p = [v for v in json_object.values()]
-        node_df = pl.DataFrame(p)
-        node_df = node_df.drop(["core_spec_cnt", "cpu_spec_list", "core_spec_cnt", "extra", "features", "features_active", "mcs_label", "mem_spec_limit", "owner", "tmp_disk", "reason_time", "reason", "reason_uid", "power_mgmt", "energy"])
-        node_df = node_df.with_columns(pl.col("last_busy", "slurmd_start_time").map_elements(lambda x: datetime.fromtimestamp(x), return_dtype=pl.Datetime))
-        node_df = node_df.with_columns(pl.col("last_busy", "slurmd_start_time").map_elements(lambda x: x.strftime("%Y-%m-%d %H:%M:%S"), return_dtype=pl.Utf8))
-        node_df = node_df.with_columns(pl.col("gres", "gres_used").list.first())
-        node_df = node_df.with_columns(pl.col("gres", "gres_used").map_elements(lambda x: int(x.split(":")[-1]) if isinstance(x, str) else x, return_dtype=pl.Int64))
-        node_df = node_df.with_columns(pl.col("gres", "gres_used").fill_null(0))
-        node_df = node_df.with_columns([
-            (pl.col("real_memory") / 1024).floor(),
-            (pl.col("free_mem") / 1024).floor()
-        ])
-        node_df = node_df.filter(~pl.col("name").is_in([f"z0{i}" for i in range(10, 17)]))
-        # Le magic #
-        node_df = node_df.explode("partitions")
-        node_df = node_df.group_by("partitions").agg(pl.col("name"), pl.col("state"), pl.col("alloc_cpus").sum(), pl.col("cpus").sum(), pl.col("gres_used").sum(), pl.col("gres").sum(), pl.col("free_mem").sum(), pl.col("real_memory").sum())
-        # End of le magic #
-        node_df = node_df.with_columns(
-            pl.concat_str([
-                ((pl.col("gres_used") / pl.col("gres")) * 100).round(2).cast(pl.Utf8),
-                pl.lit("%"),
-            ]).alias("gres_usage")
+_slurm_cache = ttl_cache(ttl=config.SLURM_CACHE_TTL, stale_ttl=config.SLURM_CACHE_STALE_TTL, negative_ttl=config.SLURM_CACHE_NEGATIVE_TTL)
+
+_slurm = None
+
+
+def set_slurm_source(source):
+    """
+    Route every query in this module through `source` instead of pyslurm.
+
+    `source` only needs to expose the parts of the pyslurm API used here
+    (`node()`, `job()`, `statistics()`, `slurmdb_jobs()` and `version()`), e.g.
+    `cluster.fixtures.FixtureSlurm`. Pass None to go back to pyslurm.
+    """
+    global _slurm
+    _slurm = source
+
+
+def _get_slurm():
+    global _slurm
+    if _slurm is None:
+        import pyslurm
+        _slurm = pyslurm
+    return _slurm
+
+# Categorical columns of every snapshot share one string cache, so frames from different refreshes
+# compare and join without re-encoding. Only small vocabularies (node states, partitions) are
+# categorical, which keeps the cache bounded; job names and nodelists stay plain strings.
+pl.enable_string_cache()
+CATEGORY = pl.Categorical(ordering="lexical")
+
+# Only the node fields we actually use; everything else pyslurm returns is never materialized.
+NODE_SCHEMA = {
+    "name": pl.Utf8,
+    "state": CATEGORY,
+    "partitions": pl.List(CATEGORY),
+    "cpus": pl.Int32,
+    "alloc_cpus": pl.Int32,
+    "real_memory": pl.Int64,
+    "free_mem": pl.Int64,
+    "gres": pl.List(pl.Utf8),
+    "gres_used": pl.List(pl.Utf8),
+    "last_busy": pl.Int64,
+    "slurmd_start_time": pl.Int64,
+}
+# per-node counters summed into the partition totals
+PARTITION_TOTALS = ["alloc_cpus", "cpus", "gres_used", "gres", "free_mem", "real_memory"]
+# a node set change, a repartition or a slurmd restart (possibly with new hardware) invalidates partition membership
+MEMBERSHIP_COLUMNS = ["name", "partitions", "slurmd_start_time"]
+
+
+def _gres_count(col):
+    # the count is the last field, after the optional type, before any socket suffix: "gpu:4", "gpu:a100:4",
+    # "gpu:3090:8", "gpu:1080ti:2" or "gpu:4(S:0-1)" -> 4, 4, 8, 2, 4; nodes without gres -> 0
+    return pl.col(col).list.first().str.extract(r":(\d+)(?:\([^)]*\))?$", 1).cast(pl.Int32).fill_null(0)
+
+
+def _percent(numerator, denominator):
+    return pl.concat_str([((numerator / denominator) * 100).round(2).cast(pl.Utf8), pl.lit("%")])
+
+
+def _build_node_frame(nodes):
+    """Typed per-node frame built straight from the pyslurm node dicts."""
+    node_df = pl.from_dicts(list(nodes.values()), schema=NODE_SCHEMA)
+    return node_df.lazy().with_columns(
+        pl.from_epoch("last_busy", time_unit="s"),
+        pl.from_epoch("slurmd_start_time", time_unit="s"),
+        _gres_count("gres").alias("gres"),
+        _gres_count("gres_used").alias("gres_used"),
+        # MB -> whole GB
+        (pl.col("real_memory") // 1024).cast(pl.Int32),
+        (pl.col("free_mem") // 1024).cast(pl.Int32),
+    )
+
+
+def _aggregate_partitions(node_lf):
+    order = {partition: i for i, partition in enumerate(config.PARTITION_ORDER)}
+    return (node_lf
+        .filter(~pl.col("name").is_in(config.EXCLUDED_NODES))
+        .explode("partitions")
+        .group_by("partitions")
+        .agg(pl.col("name"), pl.col("state"), *[pl.col(col).sum() for col in PARTITION_TOTALS])
+        # partitions missing from PARTITION_ORDER sort last, alphabetically
+        .with_columns(pl.col("partitions").replace_strict(order, default=len(order), return_dtype=pl.UInt32).alias("__sort_key"))
+        .sort("__sort_key", "partitions")
+        .drop("__sort_key")
+    )
+
+
+def format_partition_df(partition_df):
+    """Add the display columns (usage percentages, "<n> GB", blank GPU counts) to a `get_slurm_partition_df` frame."""
+    if partition_df.width == 0:
+        return partition_df
+    return (partition_df.lazy()
+        .with_columns(
+            pl.when(pl.col("gres") > 0).then(_percent(pl.col("gres_used"), pl.col("gres"))).otherwise(pl.lit("")).alias("gres_usage"),
+            _percent(pl.col("alloc_cpus"), pl.col("cpus")).alias("cpus_usage"),
+            _percent(pl.col("real_memory") - pl.col("free_mem"), pl.col("real_memory")).alias("mem_usage"),
         )
-        node_df = node_df.with_columns(
-            pl.concat_str([
-                ((pl.col("alloc_cpus") / pl.col("cpus")) * 100).round(2).cast(pl.Utf8),
-                pl.lit("%")
-            ]).alias("cpus_usage")
+        .with_columns(
+            pl.concat_str([pl.col("real_memory").cast(pl.Utf8), pl.lit(" GB")]),
+            pl.when(pl.col("gres") > 0).then(pl.col("gres").cast(pl.Utf8)).otherwise(pl.lit("")),
         )
-        node_df = node_df.with_columns(
-            pl.concat_str([
-                (((pl.col("real_memory") - pl.col("free_mem")) / pl.col("real_memory")) * 100).round(2).cast(pl.Utf8),
-                pl.lit("%")
-            ]).alias("mem_usage")
+        .collect()
+    )
+
+
+@_slurm_cache
+def get_slurm_node_state_df():
+    """One row per node: state, partitions, CPU, GPU and memory (GB) counts as numbers."""
+    try:
+        with span("slurm.fetch.nodes"):
+            nodes = _get_slurm().node().get()
+        with span("transform.nodes"):
+            return _build_node_frame(nodes).collect()
+    except ValueError as e:
+        logger.error(f"Error - {e.args[0]}")
+        return pl.DataFrame()
+
+
+def aggregate_partitions(node_state_df):
+    """Per-partition totals of a `get_slurm_node_state_df` frame, in PARTITION_ORDER."""
+    if node_state_df.width == 0:
+        return node_state_df
+    with span("transform.partitions"):
+        return _aggregate_partitions(node_state_df.lazy()).collect()
+
+
+class PartitionAggregator:
+    """
+    Keeps per-partition totals up to date across node refreshes.
+
+    The node -> partition membership index is only rebuilt (with a full
+    group-by) when MEMBERSHIP_COLUMNS change. Otherwise the node rows line up
+    with the previous refresh, so `update()` compares them column by column,
+    and adds the deltas of the nodes that changed to the totals of their
+    partitions; the per-partition state lists are only regathered when some
+    node changed state. When nothing changed the previous frame is returned as is.
+    """
+
+    def __init__(self):
+        self._membership = None
+        # (partitions, name) pairs in the order of the partition frame's name lists; nodes without
+        # partitions form a null partition, hence the null-equal joins on it
+        self._members = None
+        self._nodes = None
+        self._partition_df = None
+        self.rebuilds = 0
+        self.updates = 0
+
+    @staticmethod
+    def _membership_of(node_state_df):
+        # flat columns compare much faster than the List(Utf8) partitions column itself
+        partitions = node_state_df["partitions"]
+        return [node_state_df["name"], node_state_df["slurmd_start_time"], partitions.list.len(), partitions.explode()]
+
+    def _membership_changed(self, membership):
+        return self._membership is None or not all(new.equals(old) for new, old in zip(membership, self._membership))
+
+    def update(self, node_state_df):
+        if node_state_df.width == 0:
+            return node_state_df
+        nodes = node_state_df.select("name", "state", *PARTITION_TOTALS)
+        membership = self._membership_of(node_state_df)
+        if self._membership_changed(membership):
+            with span("transform.partitions.rebuild"):
+                self._partition_df = _aggregate_partitions(node_state_df.lazy()).collect()
+                self._members = self._partition_df.select("partitions", "name").explode("name")
+                self._membership, self._nodes = membership, nodes
+                self.rebuilds += 1
+            return self._partition_df
+
+        with span("transform.partitions.incremental"):
+            previous, self._nodes = self._nodes, nodes
+            changed = pl.concat([nodes, previous.select(pl.all().name.suffix("_old")).drop("name_old")], how="horizontal").filter(
+                pl.any_horizontal([pl.col(col).ne_missing(pl.col(f"{col}_old")) for col in ("state", *PARTITION_TOTALS)])
+            )
+            if changed.is_empty():
+                return self._partition_df
+
+            # excluded nodes have no members rows, so the inner join drops them
+            deltas = (changed
+                # sums skip nulls, so a null counter contributes 0
+                .select("name", *[(pl.col(col).fill_null(0) - pl.col(f"{col}_old").fill_null(0)).alias(col) for col in PARTITION_TOTALS])
+                .join(self._members, on="name")
+                .group_by("partitions")
+                .agg(pl.col(col).sum().alias(f"{col}_delta") for col in PARTITION_TOTALS)
+            )
+            partition_df = (self._partition_df
+                .join(deltas, on="partitions", how="left", nulls_equal=True, maintain_order="left")
+                .with_columns(pl.col(col) + pl.col(f"{col}_delta").fill_null(0) for col in PARTITION_TOTALS)
+                .drop(f"{col}_delta" for col in PARTITION_TOTALS)
+            )
+            if changed.select(pl.col("state").ne_missing(pl.col("state_old")).any()).item():
+                states = (self._members
+                    .join(nodes.select("name", "state"), on="name", how="left", maintain_order="left")
+                    .group_by("partitions", maintain_order=True)
+                    .agg("state")
+                )
+                partition_df = (partition_df
+                    .drop("state")
+                    .join(states, on="partitions", how="left", nulls_equal=True, maintain_order="left")
+                    .select(self._partition_df.columns)
+                )
+            self._partition_df = partition_df
+            self.updates += 1
+            return partition_df
+
+
+@_slurm_cache
+def get_slurm_partition_df():
+    """Per-partition node, CPU, GPU and memory (GB) totals as numbers, in PARTITION_ORDER."""
+    return aggregate_partitions(get_slurm_node_state_df.__wrapped__())
+
+
+# Base states and flags `slurm_job_state_string` reports; anything else is stored as UNKNOWN
+JOB_STATE = pl.Enum([
+    "PENDING", "RUNNING", "SUSPENDED", "COMPLETED", "CANCELLED", "FAILED", "TIMEOUT", "NODE_FAIL", "PREEMPTED",
+    "BOOT_FAIL", "DEADLINE", "OUT_OF_MEMORY", "COMPLETING", "CONFIGURING", "RESIZING", "RESV_DEL_HOLD", "REQUEUED",
+    "REQUEUE_FED", "REQUEUE_HOLD", "SPECIAL_EXIT", "STOPPED", "REVOKED", "SIGNALING", "STAGE_OUT", "UNKNOWN",
+])
+
+# Projection applied while reading the pyslurm job dicts; a job record has ~100 fields.
+JOB_SCHEMA = {
+    "name": pl.Utf8,
+    "partition": CATEGORY,
+    "nodes": pl.Utf8,
+    "num_nodes": pl.UInt32,
+    "job_state": pl.Utf8,
+    "run_time": pl.UInt32,
+    "user_id": pl.UInt32,
+    "array_job_id": pl.UInt32,
+    "array_task_id": pl.UInt32,
+    # set instead of array_task_id on the record of an array's still-pending tasks, e.g. "5-100%10"
+    "array_task_str": pl.Utf8,
+}
+JOB_NAME_WIDTH = 10
+
+
+def _format_time_expr(col):
+    """Vectorized `utils.utils._format_time`: [D:][HH:]MM:SS."""
+    seconds = pl.col(col)
+    days = seconds // (24 * 60 * 60)
+    hours = (seconds % (24 * 60 * 60)) // (60 * 60)
+    mins = (seconds % (60 * 60)) // 60
+    secs = seconds % 60
+    return pl.concat_str([
+        pl.when(days > 0).then(pl.concat_str([days.cast(pl.Utf8), pl.lit(":")])).otherwise(pl.lit("")),
+        pl.when(hours > 0).then(pl.concat_str([hours.cast(pl.Utf8).str.zfill(2), pl.lit(":")])).otherwise(pl.lit("")),
+        mins.cast(pl.Utf8).str.zfill(2),
+        pl.lit(":"),
+        secs.cast(pl.Utf8).str.zfill(2),
+    ])
+
+
+def _build_job_frame(jobs):
+    """Typed job frame holding only the JOB_SCHEMA fields of the pyslurm job dicts."""
+    columns = {"id": list(jobs)}
+    columns.update({field: [job.get(field) for job in jobs.values()] for field in JOB_SCHEMA})
+    return pl.DataFrame(columns, schema={"id": pl.UInt32, **JOB_SCHEMA})
+
+
+def _type_jobs(job_lf):
+    job_state = pl.col("job_state")
+    return (job_lf
+        .with_columns(pl.when(job_state.is_in(JOB_STATE.categories)).then(job_state).otherwise(pl.lit("UNKNOWN")).cast(JOB_STATE))
+        .sort("run_time", descending=True)
+    )
+
+
+def format_job_columns(job_df):
+    """
+    Display columns of a `get_slurm_job_df` (or `collapse_job_arrays`) frame:
+    string ids, names cut to JOB_NAME_WIDTH and `run_time_str` as [D:][HH:]MM:SS.
+    Snapshots keep the typed values; this runs when a table is rendered.
+    """
+    name = pl.col("name")
+    return job_df.with_columns(
+        pl.col("id").cast(pl.Utf8),
+        pl.when(name.str.len_chars() > JOB_NAME_WIDTH)
+            .then(pl.concat_str([name.str.slice(0, JOB_NAME_WIDTH), pl.lit("...")]))
+            .otherwise(name)
+            .alias("name"),
+        _format_time_expr("run_time").alias("run_time_str"),
+    )
+
+
+def collapse_job_arrays(job_df):
+    """
+    Replace the tasks of every job array in a `get_slurm_job_df` frame by one row
+    per array, like squeue does for pending arrays: id `434940_[1-3,7]`, the
+    summed node count, the longest run time and per-state task counts
+    (`RUNNING:3 COMPLETED:293`) as job_state. Other jobs are left as they are,
+    with id, partition and job_state as strings like the array rows.
+    """
+    columns = ["id", "name", "partition", "nodes", "num_nodes", "job_state", "user_id", "run_time"]
+    is_array = pl.col("array_job_id").is_not_null()
+    tasks = job_df.lazy().filter(is_array)
+
+    # consecutive task ids share `task id - rank`, which turns each run into one "first-last" piece
+    task_id = pl.col("array_task_id")
+    runs = (tasks
+        .filter(task_id.is_not_null())
+        .with_columns((task_id - task_id.rank("ordinal").over("array_job_id").cast(pl.Int64)).alias("run"))
+        .group_by("array_job_id", "run")
+        .agg(task_id.min().alias("first"), task_id.max().alias("last"))
+        .select(
+            "array_job_id",
+            "first",
+            pl.when(pl.col("first") == pl.col("last"))
+                .then(pl.col("first").cast(pl.Utf8))
+                .otherwise(pl.concat_str([pl.col("first"), pl.lit("-"), pl.col("last")]))
+                .alias("piece"),
         )
-        node_df = node_df.with_columns(
-            pl.concat_str([
-                (pl.col("real_memory").cast(pl.Utf8)),
-                pl.lit(" GB"),
-            ])
+    )
+    pending = (tasks
+        .filter(task_id.is_null() & pl.col("array_task_str").is_not_null())
+        .select(
+            "array_job_id",
+            pl.col("array_task_str").str.extract(r"^(\d+)", 1).cast(pl.UInt32).alias("first"),
+            pl.col("array_task_str").alias("piece"),
         )
-        node_df = node_df.with_columns(pl.col("gres_usage").replace("NaN%", ""))
-        node_df = node_df.with_columns(pl.col("gres").cast(pl.Utf8).replace("0", ""))
-        custom_order = ["30mins", "4hours", "12hours", "5days", "gpu"]
-        order_dict = {val: i for i, val in enumerate(custom_order)}
-        node_df = (node_df
-            .with_columns(
-                pl.col("partitions").map_elements(lambda x: order_dict.get(x), return_dtype=pl.Int64).alias("__sort_key")
-            )
-            .sort("__sort_key")
-            .drop("__sort_key")
+    )
+    ranges = (pl.concat([runs, pending])
+        .sort("array_job_id", "first")
+        .group_by("array_job_id", maintain_order=True)
+        .agg(pl.col("piece").str.join(","))
+    )
+    states = (tasks
+        .group_by("array_job_id", "job_state")
+        .len()
+        .sort("array_job_id", "len", "job_state", descending=[False, True, False])
+        .group_by("array_job_id", maintain_order=True)
+        .agg(pl.concat_str([pl.col("job_state").cast(pl.Utf8), pl.lit(":"), pl.col("len").cast(pl.Utf8)]).str.join(" ").alias("job_state"))
+    )
+    nodes = pl.col("nodes").drop_nulls().unique()
+    arrays = (tasks
+        .group_by("array_job_id")
+        .agg(
+            pl.col("name").first(),
+            pl.col("partition").cast(pl.Utf8).unique().sort().str.join(","),
+            nodes.first().alias("nodes"),
+            nodes.len().alias("nodelists"),
+            pl.col("num_nodes").sum(),
+            pl.col("user_id").first(),
+            pl.col("run_time").max(),
+        )
+        .join(ranges, on="array_job_id", how="left")
+        .join(states, on="array_job_id", how="left")
+        .with_columns(
+            pl.concat_str([pl.col("array_job_id").cast(pl.Utf8), pl.lit("_["), pl.col("piece").fill_null(""), pl.lit("]")]).alias("id"),
+            pl.when(pl.col("nodelists") > 1)
+                .then(pl.concat_str([pl.col("nodelists").cast(pl.Utf8), pl.lit(" nodelists")]))
+                .otherwise(pl.col("nodes"))
+                .alias("nodes"),
         )
-        return node_df
+        .select(columns)
+    )
+    singles = job_df.lazy().filter(~is_array).select(columns).with_columns(pl.col("id", "partition", "job_state").cast(pl.Utf8))
+    return (pl.concat([singles, arrays], how="vertical_relaxed")
+        .sort("run_time", descending=True)
+        .collect()
+    )
+
+
+@_slurm_cache
+def get_slurm_job_df():
+    try:
+        with span("slurm.fetch.jobs"):
+            jobs = _get_slurm().job().get()
+        with span("transform.jobs"):
+            return _type_jobs(_build_job_frame(jobs).lazy()).collect()
     except ValueError as e:
         logger.error(f"Error - {e.args[0]}")
         return pl.DataFrame()
 
 
-@cache_for_n_seconds(seconds=2)
-def get_slurm_job_df():
+@ttl_cache(ttl=config.SLURM_CACHE_TTL, maxsize=256, negative_ttl=config.SLURM_CACHE_NEGATIVE_TTL)
+def get_slurm_user_job_df(unix_uid):
+    """
+    Jobs of a single user, filtered by slurmctld (`slurm_load_job_user`) rather
+    than by loading the whole queue. Same columns as `get_slurm_job_df`.
+    """
     try:
-        jobs_json_string = json.dumps(pyslurm.job().get())
-        jobs_json = json.loads(jobs_json_string)
-        jobs = []
-        for k, v in jobs_json.items():
-            v.update({"id": k})
-            jobs.append(v)
-        jobs_df = pl.DataFrame(jobs, infer_schema_length=None)
-        jobs_df = jobs_df.drop(["cpus_allocated", "cpus_alloc_layout"])
-        jobs_df = jobs_df.with_columns(pl.col("eligible_time", "end_time", "start_time", "submit_time").map_elements(lambda x: datetime.fromtimestamp(x), return_dtype=pl.Datetime))
-        jobs_df = jobs_df.sort("run_time", descending=True)
-        jobs_df = jobs_df.with_columns(pl.col("run_time").map_elements(lambda x: _format_time(x), return_dtype=pl.Utf8).alias("run_time_str"))
-        jobs_df = jobs_df.with_columns(pl.col("user_id").cast(pl.Utf8))
-        jobs_df = jobs_df.with_columns(pl.col("name").map_elements(lambda x: x[:10] + "..." if len(x) > 10 else x, return_dtype=pl.Utf8))
-        jobs_df = jobs_df.select("id", "name", "partition", "nodes", "num_nodes", "job_state", "run_time_str", "user_id")
-        return jobs_df
+        with span("slurm.fetch.user_jobs"):
+            job = _get_slurm().job()
+            if hasattr(job, "find_user"):
+                jobs = job.find_user(int(unix_uid))
+            else:
+                jobs = {job_id: v for job_id, v in job.get().items() if v.get("user_id") == int(unix_uid)}
+        with span("transform.user_jobs"):
+            return _type_jobs(_build_job_frame(jobs or {}).lazy()).collect()
     except ValueError as e:
         logger.error(f"Error - {e.args[0]}")
         return pl.DataFrame()
 
 
-@cache_for_n_seconds(seconds=2)
+@_slurm_cache
 def get_slurm_statistics_df():
     try:
-        jobs_json_string = json.dumps(pyslurm.statistics().get())
+        with span("slurm.fetch.statistics"):
+            jobs_json_string = json.dumps(_get_slurm().statistics().get())
         jobs_json = json.loads(jobs_json_string)
         jobs_json.pop("rpc_type_stats")
         jobs_json.pop("rpc_user_stats")
@@ -107,6 +418,17 @@ def get_slurm_statistics_df():
         logger.error(f"Error - {e.args[0]}")
         return pl.DataFrame()
 
-@cache_for_n_seconds(seconds=2)
+@_slurm_cache
 def get_slurm_version():
-    return pyslurm.version()
\ No newline at end of file
+    with span("slurm.fetch.version"):
+        return _get_slurm().version()
+
+
+def get_slurmdb_jobs(start, end):
+    """
+    Accounting records (pyslurm dicts keyed by job id) of every job slurmdbd saw
+    pending or running between `start` and `end` (epoch seconds). Not cached and
+    errors are raised, so a report never silently misses a window.
+    """
+    with span("slurmdb.fetch.jobs"):
+        return _get_slurm().slurmdb_jobs().get(starttime=int(start), endtime=int(end))
@@ -0,0 +1,70 @@
+import polars as pl
+
+from utils.trace import traced
+
+# Slack rejects section text over 3000 characters and messages over 50 blocks
+BLOCK_TEXT_LIMIT = 3000
+MAX_BLOCKS = 50
+_FENCE = "```"
+
+
+@traced("render.table")
+def render_table(df: pl.DataFrame, headers: dict = None) -> str:
+    """
+    Render `df` as a fixed-width text table.
+
+    Cells are padded column-wise with Polars string expressions rather than
+    row by row; numeric columns are right-aligned, everything else left-aligned.
+
+    Args:
+        df (pl.DataFrame): frame with scalar columns.
+        headers (dict): column name -> header text. Columns not in it use their own name.
+    """
+    headers = headers or {}
+    titles = [headers.get(col, col) for col in df.columns]
+    cells = df.select(pl.col(col).cast(pl.Utf8).fill_null("") for col in df.columns)
+
+    widths = []
+    padded = []
+    for col, title in zip(df.columns, titles):
+        width = max(len(title), cells[col].str.len_chars().max() or 0)
+        widths.append(width)
+        if df.schema[col].is_numeric():
+            padded.append(pl.col(col).str.pad_start(width))
+        else:
+            padded.append(pl.col(col).str.pad_end(width))
+
+    border = "+" + "+".join("-" * (width + 2) for width in widths) + "+"
+    header = "| " + " | ".join(title.ljust(width) for title, width in zip(titles, widths)) + " |"
+    lines = []
+    if df.columns and df.height:
+        rows = cells.select(pl.concat_str([pl.lit("| "), pl.concat_str(padded, separator=" | "), pl.lit(" |")]).alias("row"))
+        lines = rows["row"].to_list()
+    return "\n".join([border, header, border, *lines, border])
+
+
+def table_blocks(text: str, max_blocks: int = MAX_BLOCKS) -> list:
+    """
+    Split preformatted `text` into Block Kit section blocks of at most
+    BLOCK_TEXT_LIMIT characters, breaking on line boundaries. Output beyond
+    `max_blocks` is truncated with a note saying how many lines were dropped.
+    """
+    budget = BLOCK_TEXT_LIMIT - 2 * len(_FENCE) - 2
+    lines = text.split("\n")
+    pages, page, size = [], [], 0
+    for i, line in enumerate(lines):
+        line = line[:budget]
+        if page and size + len(line) + 1 > budget:
+            pages.append(page)
+            page, size = [], 0
+            if len(pages) == max_blocks:
+                pages[-1] = pages[-1][:-1] + [f"... {len(lines) - i + 1} more lines truncated"]
+                break
+        page.append(line)
+        size += len(line) + 1
+    else:
+        pages.append(page)
+    return [
+        {"type": "section", "text": {"type": "mrkdwn", "text": f"{_FENCE}\n" + "\n".join(page) + f"\n{_FENCE}"}}
+        for page in pages
+    ]
@@ -0,0 +1,220 @@
+import threading
+import time
+from dataclasses import dataclass
+
+import polars as pl
+
+import config
+from cluster.query_slurm import (get_slurm_node_state_df, get_slurm_job_df, get_slurm_statistics_df,
+                                 PartitionAggregator)
+from utils.log import get_logger
+from utils.trace import span
+
+logger = get_logger(__name__)
+
+FRAMES = ("node_state_df", "partition_df", "job_df", "statistics_df")
+_SIZE_UNITS = {"b": 1, "kb": 1024, "mb": 1024 ** 2, "gb": 1024 ** 3}
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """One consistent, read-only view of the cluster. Never mutate the frames."""
+    version: int
+    taken_at: float
+    node_state_df: pl.DataFrame
+    partition_df: pl.DataFrame
+    job_df: pl.DataFrame
+    statistics_df: pl.DataFrame
+    cluster: str = config.DEFAULT_CLUSTER
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.taken_at
+
+    def estimated_size(self, unit="b") -> float:
+        """Memory held by this snapshot's frames, as estimated by Polars (`unit`: b, kb, mb or gb)."""
+        return estimated_size([self], unit)
+
+
+def estimated_size(snapshots, unit="b") -> float:
+    """
+    Memory held by `snapshots` together. Consecutive snapshots share the frames
+    that didn't change between refreshes; those are counted once.
+    """
+    frames = {}
+    for snapshot in snapshots:
+        if snapshot is not None:
+            for attr in FRAMES:
+                df = getattr(snapshot, attr)
+                frames[id(df)] = df
+    return sum(df.estimated_size() for df in frames.values()) / _SIZE_UNITS[unit]
+
+
+class SnapshotService:
+    """
+    Owns the node/job/statistics snapshots and refreshes them on a background thread.
+
+    Readers call `latest()`, which returns the most recently published `Snapshot`
+    (or None before the first refresh) without touching pyslurm. A refresh builds
+    a complete new `Snapshot` and publishes it with a single reference swap, so
+    readers never see a half-updated view. Callbacks registered with `subscribe()`
+    are then called with the new snapshot on the refresher thread.
+    """
+
+    def __init__(self, interval=config.SNAPSHOT_REFRESH_SECONDS, adaptive=True, cluster=config.DEFAULT_CLUSTER):
+        self.cluster = cluster
+        self.base_interval = interval
+        self.interval = interval
+        self.interval_reason = "default"
+        self.adaptive = adaptive
+        self._failed_fetches = 0
+        self._snapshot = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._subscribers = []
+        self._partitions = PartitionAggregator()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def latest(self):
+        return self._snapshot
+
+    def subscribe(self, callback):
+        """Call `callback(snapshot)` after every publish. Keep it quick; it delays the next refresh."""
+        self._subscribers.append(callback)
+
+    @property
+    def max_snapshot_age(self) -> float:
+        """How old a snapshot readers should accept; grows while refreshes are backed off."""
+        return config.SQUEUE_SNAPSHOT_MAX_AGE + max(0, self.interval - self.base_interval)
+
+    def wait_ready(self, timeout=None) -> bool:
+        return self._ready.wait(timeout)
+
+    def start(self):
+        if self.running:
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="snapshot-refresher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Snapshot refresh failed: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def _fetch(self, getter, previous):
+        # The getters return a column-less frame when pyslurm raised; keep the last good frame then.
+        df = getter.__wrapped__()
+        if df.width == 0:
+            self._failed_fetches += 1
+            if previous is not None:
+                logger.warning(f"{getter.__name__} failed, keeping data from the previous snapshot")
+                return previous
+        return df
+
+    def _adapt(self, statistics_df, refresh_seconds):
+        interval, reason = choose_interval(self.interval, self.base_interval, statistics_df, refresh_seconds, self._failed_fetches)
+        if interval != self.interval:
+            logger.info(f"Snapshot refresh interval {self.interval:g}s -> {interval:g}s ({reason})")
+        self.interval, self.interval_reason = interval, reason
+
+    def refresh(self) -> Snapshot:
+        with self._refresh_lock, span("snapshot.refresh"):
+            previous = self._snapshot
+            start = time.time()
+            self._failed_fetches = 0
+            node_state_df = self._fetch(get_slurm_node_state_df, previous and previous.node_state_df)
+            if previous is not None and node_state_df is previous.node_state_df:
+                partition_df = previous.partition_df
+            else:
+                partition_df = self._partitions.update(node_state_df)
+            snapshot = Snapshot(
+                version=previous.version + 1 if previous else 1,
+                taken_at=start,
+                node_state_df=node_state_df,
+                partition_df=partition_df,
+                job_df=self._fetch(get_slurm_job_df, previous and previous.job_df),
+                statistics_df=self._fetch(get_slurm_statistics_df, previous and previous.statistics_df),
+                cluster=self.cluster,
+            )
+            self._snapshot = snapshot
+            self._ready.set()
+            logger.debug(f"Published snapshot v{snapshot.version} in {(time.time() - start) * 1000:.2f} ms")
+            if self.adaptive:
+                self._adapt(snapshot.statistics_df, time.time() - start)
+        for callback in self._subscribers:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.error(f"Snapshot subscriber {getattr(callback, '__qualname__', callback)} failed: {e}")
+        return snapshot
+
+
+def controller_load(statistics_df):
+    """The sdiag fields the refresh interval reacts to, or None when statistics are unavailable."""
+    if statistics_df is None or statistics_df.is_empty():
+        return None
+    row = statistics_df.row(0, named=True)
+    return {
+        "agent_queue_size": row.get("agent_queue_size") or 0,
+        "server_thread_count": row.get("server_thread_count") or 0,
+        # sdiag reports schedule cycle times in microseconds
+        "schedule_cycle_last": (row.get("schedule_cycle_last") or 0) / 1e6,
+    }
+
+
+def choose_interval(current, base, statistics_df, refresh_seconds, failed_fetches=0):
+    """
+    Next refresh interval and the reason for it. Doubles (up to SNAPSHOT_MAX_REFRESH_SECONDS)
+    while slurmctld reports backlog or slow scheduling, the refresh itself was slow or failed;
+    halves (down to SNAPSHOT_MIN_REFRESH_SECONDS) while it is idle; otherwise steps back to `base`.
+    """
+    load = controller_load(statistics_df)
+    busy = []
+    if failed_fetches:
+        busy.append(f"{failed_fetches} failed queries")
+    if refresh_seconds >= config.SNAPSHOT_BUSY_FETCH_SECONDS:
+        busy.append(f"refresh took {refresh_seconds:.1f}s")
+    if load is not None:
+        if load["agent_queue_size"] >= config.SNAPSHOT_BUSY_AGENT_QUEUE:
+            busy.append(f"agent queue {load['agent_queue_size']}")
+        if load["server_thread_count"] >= config.SNAPSHOT_BUSY_SERVER_THREADS:
+            busy.append(f"{load['server_thread_count']} server threads")
+        if load["schedule_cycle_last"] >= config.SNAPSHOT_BUSY_CYCLE_SECONDS:
+            busy.append(f"schedule cycle {load['schedule_cycle_last']:.1f}s")
+    if busy:
+        return min(current * 2, config.SNAPSHOT_MAX_REFRESH_SECONDS), f"backing off: {', '.join(busy)}"
+
+    idle = (load is not None
+        and load["agent_queue_size"] == 0
+        and load["server_thread_count"] <= config.SNAPSHOT_BUSY_SERVER_THREADS / 4
+        and load["schedule_cycle_last"] <= config.SNAPSHOT_BUSY_CYCLE_SECONDS / 4
+        and refresh_seconds <= config.SNAPSHOT_BUSY_FETCH_SECONDS / 4)
+    if idle:
+        return max(current / 2, config.SNAPSHOT_MIN_REFRESH_SECONDS), "controller idle"
+    if current > base:
+        return max(current / 2, base), "recovering"
+    return base, "normal load"
+
+
+_service = SnapshotService()
+
+
+def get_snapshot_service() -> SnapshotService:
+    return _service
@@ -0,0 +1,150 @@
+import hashlib
+import io
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import polars as pl
+
+import config
+from utils.cache import CACHES, TTLCache
+from utils.log import get_logger
+from utils.trace import span
+
+logger = get_logger(__name__)
+
+_pool = None
+# rendered PNGs by topology key; a key only changes when membership or a usage bucket does
+_png_cache = CACHES[f"{__name__}.png"] = TTLCache(f"{__name__}.png", config.TOPOLOGY_CACHE_TTL, maxsize=config.TOPOLOGY_CACHE_SIZE)
+
+
+def _bucket(used, total):
+    """Usage fraction rounded down to a multiple of TOPOLOGY_USAGE_BUCKET."""
+    step = config.TOPOLOGY_USAGE_BUCKET
+    return (pl.when(total > 0).then(used / total).otherwise(0.0) / step).floor() * step
+
+
+def topology_payload(node_state_df: pl.DataFrame) -> dict:
+    """
+    Plain-Python description of the partition/node graph of a `get_slurm_node_state_df`
+    frame: partition -> nodes, plus bucketed CPU usage per node and per partition.
+    Everything in it is picklable, so it can be shipped to the render process as is.
+    """
+    nodes = (node_state_df.lazy()
+        .filter(~pl.col("name").is_in(config.EXCLUDED_NODES))
+        .explode("partitions")
+        .filter(pl.col("partitions").is_not_null())
+    )
+    memberships = (nodes
+        .group_by("partitions")
+        .agg(pl.col("name").sort(), _bucket(pl.col("alloc_cpus").sum(), pl.col("cpus").sum()).alias("usage"))
+        .collect()
+    )
+    node_usage = (nodes
+        .unique("name")
+        .select("name", _bucket(pl.col("alloc_cpus"), pl.col("cpus")).alias("usage"))
+        .sort("name")
+        .collect()
+    )
+
+    order = {partition: i for i, partition in enumerate(config.PARTITION_ORDER)}
+    partitions = sorted(memberships["partitions"].to_list(), key=lambda p: (order.get(p, len(order)), p))
+    by_partition = {row["partitions"]: row for row in memberships.iter_rows(named=True)}
+    return {
+        "partition_nodes": {p: by_partition[p]["name"] for p in partitions},
+        "partition_usage": {p: round(by_partition[p]["usage"], 4) for p in partitions},
+        "node_usage": {name: round(usage, 4) for name, usage in node_usage.iter_rows()},
+    }
+
+
+def topology_key(payload: dict) -> str:
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def render_topology_png(payload: dict) -> bytes:
+    """
+    Draw the graph from `topology_payload` as a PNG. Runs in the render process:
+    partitions are squares on a fixed circle, compute nodes are circles pulled
+    towards their partitions, all coloured by CPU usage.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import networkx as nx
+
+    partition_nodes = payload["partition_nodes"]
+    partition_usage = payload["partition_usage"]
+    node_usage = payload["node_usage"]
+    partitions = list(partition_nodes)
+    compute_nodes = sorted({node for nodes in partition_nodes.values() for node in nodes})
+    cmap = plt.cm.YlOrRd
+
+    graph = nx.Graph()
+    graph.add_nodes_from(partitions)
+    graph.add_nodes_from(compute_nodes)
+    for partition, nodes in partition_nodes.items():
+        graph.add_edges_from((partition, node) for node in nodes)
+
+    fig, ax = plt.subplots(figsize=(14, 12))
+    partition_pos = nx.circular_layout(partitions)
+    # fixed seed so an unchanged topology always gets the same picture
+    pos = nx.spring_layout(graph, k=0.3, iterations=50, fixed=partitions, pos=partition_pos, seed=0)
+
+    nx.draw_networkx_nodes(graph, pos, nodelist=partitions, node_size=1200, node_shape="s", alpha=0.8, ax=ax,
+                           node_color=[cmap(partition_usage[p]) for p in partitions])
+    nx.draw_networkx_nodes(graph, pos, nodelist=compute_nodes, node_size=200, alpha=0.8, ax=ax,
+                           node_color=[cmap(node_usage.get(node, 0.0)) for node in compute_nodes])
+    for partition in partitions:
+        nx.draw_networkx_edges(graph, pos, edgelist=[(partition, node) for node in partition_nodes[partition]],
+                               width=1.0, alpha=0.5, edge_color=[cmap(partition_usage[partition])], ax=ax)
+
+    nx.draw_networkx_labels(graph, pos, labels={p: p for p in partitions}, font_size=14, font_weight="bold", ax=ax)
+    # only label nodes shared between partitions to avoid clutter
+    shared = {node for node in compute_nodes if graph.degree(node) > 1}
+    nx.draw_networkx_labels(graph, pos, labels={node: node for node in shared}, font_size=8, ax=ax)
+
+    colorbar = fig.colorbar(plt.cm.ScalarMappable(cmap=cmap, norm=plt.Normalize(0, 100)), ax=ax)
+    colorbar.set_label("CPU Usage (%)")
+    ax.scatter([], [], s=200, c="gray", alpha=0.5, marker="s", label="Partition")
+    ax.scatter([], [], s=200, c="gray", alpha=0.5, marker="o", label="Node")
+    ax.legend(scatterpoints=1, frameon=False, labelspacing=1)
+    ax.set_title("SLURM Partition and Node Resource Usage")
+    ax.axis("off")
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=config.TOPOLOGY_DPI)
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """
+    Process pool for matplotlib rendering. Forked workers are all started on the
+    first submit, so call `warm_up()` at startup before other threads exist.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=config.TOPOLOGY_WORKERS, mp_context=multiprocessing.get_context("fork"))
+    return _pool
+
+
+def warm_up():
+    get_render_pool().submit(int).result()
+
+
+def get_topology_png(node_state_df: pl.DataFrame) -> bytes:
+    """
+    PNG of the current topology, rendered in the process pool. Blocks the calling
+    thread (not the event loop) until done; concurrent requests for the same
+    topology share one render and later ones are served from the cache.
+    """
+    payload = topology_payload(node_state_df)
+    key = topology_key(payload)
+
+    def render():
+        logger.info(f"Rendering topology {key[:8]} ({len(payload['node_usage'])} nodes)")
+        with span("render.topology"):
+            return get_render_pool().submit(render_topology_png, payload).result()
+
+    return _png_cache.get(key, render)
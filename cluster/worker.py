@@ -0,0 +1,55 @@
+"""
+Snapshot worker for one Slurm cluster, started by `cluster.clusters.ClusterWorker`.
+
+pyslurm reads slurm.conf once per process, so every extra cluster gets its own
+process with SLURM_CONF pointing at that cluster's config. The worker runs a
+`SnapshotService` and writes every published snapshot, pickled, to stdout. It
+exits when its stdin is closed, i.e. when the bot goes away.
+
+    SLURM_CONF=/etc/slurm/other/slurm.conf python -m cluster.worker other
+    python -m cluster.worker other --fixtures notebooks    # FixtureSlurm instead of pyslurm
+"""
+import argparse
+import pickle
+import sys
+import threading
+
+import config
+from utils.log import setup_logger
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cluster", help="cluster name the snapshots are tagged with")
+    parser.add_argument("--fixtures", help="serve this fixture directory through FixtureSlurm instead of pyslurm")
+    parser.add_argument("--latency", type=float, default=0.0, help="per-query latency of the fixtures, in seconds")
+    args = parser.parse_args()
+
+    # stdout carries the snapshots; everything else, including logs, goes to stderr
+    out = sys.stdout.buffer
+    sys.stdout = sys.stderr
+    setup_logger(level=config.LOGGER_LEVEL, color=False)
+
+    from cluster.query_slurm import set_slurm_source
+    from cluster.snapshot import SnapshotService
+    if args.fixtures:
+        from cluster.fixtures import FixtureSlurm
+        set_slurm_source(FixtureSlurm(args.fixtures, latency=args.latency))
+
+    lock = threading.Lock()
+
+    def publish(snapshot):
+        with lock:
+            pickle.dump(snapshot, out, protocol=pickle.HIGHEST_PROTOCOL)
+            out.flush()
+
+    service = SnapshotService(cluster=args.cluster)
+    service.subscribe(publish)
+    service.start()
+    # block until the parent closes our stdin (or dies)
+    sys.stdin.buffer.read()
+    service.stop(timeout=1)
+
+
+if __name__ == "__main__":
+    main()
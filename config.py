@@ -2,4 +2,114 @@ import logging
 
 LOGGER_PREFIX = 'vggbot'
 LOGGER_OUTPUT = 'logs'
-LOGGER_LEVEL = logging.INFO
\ No newline at end of file
+LOGGER_LEVEL = logging.INFO
+# Hand records to a background listener thread instead of writing them from the Slack handlers
+LOGGER_QUEUE = True
+# Log file as JSON lines instead of plain text
+LOGGER_JSON = False
+# Roll the log file over at this size or age, whichever comes first, keeping LOGGER_BACKUP_COUNT old files
+LOGGER_MAX_BYTES = 50 * 1024 * 1024
+LOGGER_ROTATE_SECONDS = 24 * 60 * 60
+LOGGER_BACKUP_COUNT = 14
+
+# Threads for blocking work (pyslurm queries, DataFrame transforms, rendering) offloaded from the Slack event loop
+WORKER_THREADS = 8
+
+# Command output up to this many characters is posted inline as Block Kit sections, longer output is uploaded as a file
+INLINE_TABLE_MAX_CHARS = 9000
+
+# Slack Web API base URL; loadtest.py points it at a local fake Slack
+SLACK_API_URL = 'https://slack.com/api/'
+
+# Importing app.py should take less than this; the startup report warns when it doesn't
+STARTUP_IMPORT_BUDGET_SECONDS = 1.5
+# Seconds to wait for the first snapshot and the user caches before taking commands anyway
+STARTUP_WARMUP_TIMEOUT = 60
+
+# Name of the cluster described by the local slurm.conf, queried in-process
+DEFAULT_CLUSTER = 'local'
+# Further clusters, name -> slurm.conf path. Each is queried by its own worker process with SLURM_CONF set
+CLUSTERS = {}
+# Seconds to wait before restarting a cluster worker that exited
+CLUSTER_WORKER_RESTART_SECONDS = 30
+
+# Nodes left out of the partition totals, /topology and /metrics
+EXCLUDED_NODES = [f"z0{i}" for i in range(10, 17)]
+# Display order of partitions; partitions not listed here follow alphabetically
+PARTITION_ORDER = ["30mins", "4hours", "12hours", "5days", "gpu"]
+
+# Seconds between background refreshes of the node/job/statistics snapshot
+SNAPSHOT_REFRESH_SECONDS = 10
+# The refresh interval adapts to slurmctld load within these bounds: it doubles while the controller is busy
+# (or a refresh is slow or fails), halves while it is idle and otherwise returns to SNAPSHOT_REFRESH_SECONDS
+SNAPSHOT_MIN_REFRESH_SECONDS = 5
+SNAPSHOT_MAX_REFRESH_SECONDS = 2 * 60
+# slurmctld counts as busy at or above any of these (sdiag agent queue size, server threads, last schedule cycle)
+SNAPSHOT_BUSY_AGENT_QUEUE = 100
+SNAPSHOT_BUSY_SERVER_THREADS = 32
+SNAPSHOT_BUSY_CYCLE_SECONDS = 2
+SNAPSHOT_BUSY_FETCH_SECONDS = 5
+# /squeue filters the shared snapshot only while it is at most this old; otherwise it asks slurmctld for the user's jobs
+SQUEUE_SNAPSHOT_MAX_AGE = 15
+
+
+# TTL cache in front of the cluster.query_slurm getters (seconds)
+SLURM_CACHE_TTL = 2
+# expired results may be served this much longer while they are reloaded in the background
+SLURM_CACHE_STALE_TTL = 30
+# empty/failed results are kept this long so a struggling slurmctld isn't hammered
+SLURM_CACHE_NEGATIVE_TTL = 5
+
+# Seconds the bot's membership of a channel is cached; member_joined/left_channel events update it immediately
+CHANNEL_MEMBERSHIP_TTL = 10 * 60
+
+# Unix groups whose members can be resolved from Slack
+USER_GROUPS = ["xusers", "zusers", "tusers", "rusers", "musers"]
+# Seconds after which the user directory reloads even if /etc/passwd and /etc/group are unchanged
+USER_DIRECTORY_MAX_AGE = 60 * 60
+
+# Persisted Slack user id -> Unix username map, refreshed incrementally from users.list
+SLACK2UNIX_MAP_PATH = 'data/slack2unix.json'
+# Minimum thefuzz token_sort_ratio for matching a Slack real name to a GECOS name that isn't an exact match
+SLACK2UNIX_FUZZY_THRESHOLD = 90
+# Manual Slack user id -> Unix username entries, applied on top of the automatic matches
+SLACK2UNIX_OVERRIDES = {
+    "U07BESQTQM6": "ramirezc",
+    "U086DUX6V4Y": "kresgeb",
+}
+
+# Parquet history of per-partition utilization and job snapshots, queried by /usage
+HISTORY_DIR = 'history'
+HISTORY_UTILIZATION_INTERVAL = 60
+HISTORY_JOB_INTERVAL = 5 * 60
+# a day's per-sample files are merged once there are this many, checked every HISTORY_COMPACT_INTERVAL seconds
+HISTORY_COMPACT_MIN_FILES = 12
+HISTORY_COMPACT_INTERVAL = 60 * 60
+USAGE_DEFAULT_WINDOW = '7d'
+
+# /report reads slurmdbd one REPORT_CHUNK_SECONDS window at a time, with at most REPORT_CONCURRENT_QUERIES
+# queries in flight across all reports; progress is checkpointed under REPORT_DIR so reports can be resumed
+REPORT_DIR = 'reports'
+REPORT_CHUNK_SECONDS = 24 * 60 * 60
+REPORT_CONCURRENT_QUERIES = 2
+REPORT_DEFAULT_WINDOW = '30d'
+# slurmdbd TRES ids (`sacctmgr show tres`) of the CPU and GPU counts in numeric tres_alloc_str values
+REPORT_TRES_IDS = {"cpu": "1", "gres/gpu": "1001"}
+
+# /watch notifications list at most this many job events per message
+WATCH_MAX_EVENTS_PER_MESSAGE = 20
+
+# /topology renders in this many worker processes; PNGs are cached by topology and CPU usage rounded down to TOPOLOGY_USAGE_BUCKET
+TOPOLOGY_WORKERS = 2
+TOPOLOGY_USAGE_BUCKET = 0.1
+TOPOLOGY_CACHE_TTL = 10 * 60
+TOPOLOGY_CACHE_SIZE = 16
+TOPOLOGY_DPI = 100
+
+# Upper bounds (ms) of the latency histogram buckets behind /botstats
+TRACE_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+# Local HTTP endpoint serving /stats; None disables it. Keep it on localhost, nothing there is authenticated
+HTTP_HOST = '127.0.0.1'
+HTTP_PORT = 9105
+# Also serve the snapshot's partition allocation and job-state counts in Prometheus format on /metrics
+METRICS_EXPORTER = False
@@ -0,0 +1,383 @@
+"""
+Load-test the slash-command handlers of app.py end to end.
+
+Synthetic /cluster, /squeue and /version payloads are dispatched concurrently
+through the real Bolt app, with pyslurm replaced by `cluster.fixtures.FixtureSlurm`
+and the Slack Web API by a local fake that answers (and counts) the calls the
+bot makes: auth.test, conversations.info, users.list, users.info,
+chat.postMessage, the files_upload_v2 steps and replies to response_url.
+Reports throughput and the ack and completion latency percentiles per command.
+
+Ack latency ends when Bolt hands back the ack response (what Socket Mode sends
+to Slack); Bolt polls for it every 10 ms.
+
+    python loadtest.py                                # 200 requests, all at once
+    python loadtest.py -n 1000 -c 100 --job-scale 10
+    python loadtest.py --mix squeue:1 --latency 0.5   # slow slurmctld, /squeue only
+    python loadtest.py --save load.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import string
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from tabulate import tabulate
+
+DEFAULT_MIX = "cluster:1,squeue:3,version:1"
+CHANNELS = 20
+# share of /squeue senders missing from users.list, so they resolve through users.info instead
+UNMAPPED_SHARE = 0.1
+
+
+def _letters(number):
+    """12345 -> 'rmj': Unix and Slack real names built from uids must survive slack2unix's letters-only normalization."""
+    letters = ""
+    while True:
+        number, digit = divmod(number, 26)
+        letters += string.ascii_lowercase[digit]
+        if not number:
+            return letters
+
+
+def _real_name(uid):
+    return f"Load {_letters(int(uid)).capitalize()}"
+
+
+class FakeSlack:
+    """
+    Local stand-in for the Slack Web API, served by aiohttp on an ephemeral port.
+    Every call is counted per method in `calls`; `latency` seconds are added to each.
+    """
+
+    def __init__(self, uids, latency=0.0):
+        self.uids = uids
+        self.latency = latency
+        self.calls = Counter()
+        self.url = None
+        self._runner = None
+        self._files = 0
+
+    async def start(self):
+        from aiohttp import web
+
+        app = web.Application(client_max_size=64 * 2**20)
+        # slack_sdk sends some methods (conversations.info, users.info) as GET
+        app.router.add_route("*", "/api/{method}", self._api)
+        app.router.add_post("/upload/{file_id}", self._upload)
+        app.router.add_post("/response/{trigger_id}", self._response)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        await web.SockSite(self._runner, sock).start()
+        self.url = f"http://127.0.0.1:{sock.getsockname()[1]}/api/"
+        return self
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _params(self, request):
+        params = dict(request.query)
+        if request.content_type == "application/json":
+            params.update(await request.json())
+        elif request.method == "POST":
+            params.update(await request.post())
+        return params
+
+    async def _api(self, request):
+        from aiohttp import web
+
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        handler = getattr(self, "_" + method.replace(".", "_"), None)
+        if handler is None:
+            return web.json_response({"ok": False, "error": "unknown_method"})
+        return web.json_response({"ok": True, **handler(params)})
+
+    async def _upload(self, request):
+        from aiohttp import web
+
+        await request.read()
+        self.calls["upload"] += 1
+        return web.Response(text="OK")
+
+    async def _response(self, request):
+        from aiohttp import web
+
+        await request.read()
+        self.calls["response_url"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.Response(text="ok")
+
+    def _auth_test(self, params):
+        return {"user_id": "U0LOADBOT", "bot_id": "B0LOADBOT", "team_id": "T0LOAD"}
+
+    def _conversations_info(self, params):
+        return {"channel": {"id": params.get("channel"), "is_member": True}}
+
+    def _users_list(self, params):
+        members = [{"id": f"U{uid}", "real_name": _real_name(uid), "profile": {"real_name": _real_name(uid)}}
+                   for uid in self.uids]
+        return {"members": members, "response_metadata": {"next_cursor": ""}}
+
+    def _users_info(self, params):
+        # unmapped senders are "UX<uid>"; answer with the real name of that uid
+        uid = params.get("user", "")[2:]
+        return {"user": {"id": params.get("user"), "name": f"user{uid}", "real_name": _real_name(uid)}}
+
+    def _chat_postMessage(self, params):
+        return {"channel": params.get("channel"), "ts": f"{time.time():.6f}"}
+
+    def _files_getUploadURLExternal(self, params):
+        self._files += 1
+        file_id = f"F{self._files}"
+        return {"file_id": file_id, "upload_url": f"{self.url[:-len('api/')]}upload/{file_id}"}
+
+    def _files_completeUploadExternal(self, params):
+        files = params.get("files")
+        return {"files": json.loads(files) if isinstance(files, str) else files}
+
+
+def _fixture_directory(uids):
+    """A user directory holding an account for every uid that owns fixture jobs."""
+    from utils.utils import User, UserDirectory
+
+    class FixtureDirectory(UserDirectory):
+
+        def _load(self):
+            users = [User(f"user{uid}", uid, _real_name(uid)) for uid in uids]
+            return ({user.unix_uid: user for user in users}, {user.username: user for user in users},
+                    {" ".join(user.real_name.split()).casefold(): user for user in users})
+
+    return FixtureDirectory(groups=[], watched_files=())
+
+
+class _Recorder:
+    """Wraps the Bolt listener completion/error handlers to time when each request's handler finished."""
+
+    def __init__(self, runner):
+        self.pending = {}
+        self.errors = set()
+        self._completion_handler = runner.listener_completion_handler
+        self._error_handler = runner.listener_error_handler
+        runner.listener_completion_handler = self
+        runner.listener_error_handler = _ErrorRecorder(self)
+
+    async def handle(self, request, response):
+        await self._completion_handler.handle(request=request, response=response)
+        future = self.pending.pop(request.body.get("trigger_id"), None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+
+class _ErrorRecorder:
+
+    def __init__(self, recorder):
+        self._recorder = recorder
+
+    async def handle(self, error, request, response):
+        self._recorder.errors.add(request.body.get("trigger_id"))
+        await self._recorder._error_handler.handle(error=error, request=request, response=response)
+
+
+def _parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        command, _, weight = item.partition(":")
+        mix[f"/{command.strip().lstrip('/')}"] = float(weight or 1)
+    return mix
+
+
+def _payload(i, command, uids, rng, base_url):
+    user_id = "U0LOADUSER"
+    if command == "/squeue":
+        uid = rng.choice(uids)
+        user_id = f"UX{uid}" if rng.random() < UNMAPPED_SHARE else f"U{uid}"
+    return {
+        "token": "loadtest",
+        "team_id": "T0LOAD",
+        "team_domain": "loadtest",
+        "api_app_id": "A0LOAD",
+        "channel_id": f"C{i % CHANNELS:08d}",
+        "channel_name": "loadtest",
+        "user_id": user_id,
+        "user_name": user_id.lower(),
+        "command": command,
+        "text": "",
+        "trigger_id": f"load.{i}",
+        "response_url": f"{base_url}response/load.{i}",
+    }
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q * len(values))) - 1))]
+
+
+async def _run(args):
+    # imported here: config has to point at the fake Slack and a scratch map before app.py reads it
+    import config
+    from cluster.fixtures import FixtureSlurm
+    from cluster.query_slurm import set_slurm_source
+
+    source = FixtureSlurm(node_scale=args.node_scale, job_scale=args.job_scale, latency=args.latency)
+    set_slurm_source(source)
+    uids = sorted({str(job["user_id"]) for job in source.job().get().values()})
+    source.reset_counters()
+
+    fake = await FakeSlack(uids, latency=args.slack_latency).start()
+    scratch = tempfile.TemporaryDirectory(prefix="loadtest-")
+    config.SLACK_API_URL = fake.url
+    config.SLACK2UNIX_MAP_PATH = os.path.join(scratch.name, "slack2unix.json")
+    config.LOGGER_OUTPUT = None
+    config.LOGGER_LEVEL = getattr(logging, args.log_level)
+    config.HTTP_PORT = None
+    os.environ.setdefault("SLACK_BOT_TOKEN", "xoxb-loadtest")
+    os.environ.setdefault("SLACK_SIGNING_SECRET", "loadtest")
+
+    import utils.utils
+    utils.utils._user_directory = _fixture_directory(uids)
+    import app as bot
+    from slack_bolt.request.async_request import AsyncBoltRequest
+
+    # same startup order as app.main(): the bot's identity is known before the first command arrives
+    await bot.get_channel_membership().resolve_identity(bot.app.client)
+    bot.start_render_pool()
+    service = bot.get_snapshot_service()
+    service.start()
+    if args.warm_up:
+        await bot.warm_up(service)
+    recorder = _Recorder(bot.app.listener_runner)
+
+    rng = random.Random(args.seed)
+    if args.warm_up:
+        # one unmeasured command, so Bolt's authorization (auth.test) is cached as in a bot that's been up a while
+        payload = _payload(-1, "/version", uids, rng, fake.url[:-len("api/")])
+        done = recorder.pending[payload["trigger_id"]] = asyncio.get_running_loop().create_future()
+        await bot.app.async_dispatch(AsyncBoltRequest(body=payload, mode="socket_mode"))
+        await asyncio.wait_for(done, args.timeout)
+    mix = _parse_mix(args.mix)
+    commands = rng.choices(list(mix), weights=list(mix.values()), k=args.requests)
+    semaphore = asyncio.Semaphore(args.concurrency or args.requests)
+    results = []
+
+    async def send(i, command):
+        payload = _payload(i, command, uids, rng, fake.url[:-len("api/")])
+        async with semaphore:
+            done = asyncio.get_running_loop().create_future()
+            recorder.pending[payload["trigger_id"]] = done
+            start = time.perf_counter()
+            response = await bot.app.async_dispatch(AsyncBoltRequest(body=payload, mode="socket_mode"))
+            acked = time.perf_counter()
+            try:
+                completed = await asyncio.wait_for(done, args.timeout)
+                error = response.status >= 400 or payload["trigger_id"] in recorder.errors
+            except asyncio.TimeoutError:
+                recorder.pending.pop(payload["trigger_id"], None)
+                completed, error = None, True
+        results.append({
+            "command": command,
+            "ack_seconds": acked - start,
+            "completion_seconds": None if completed is None else completed - start,
+            "error": error,
+        })
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(send(i, command) for i, command in enumerate(commands)))
+    wall = time.perf_counter() - wall_start
+
+    service.stop(timeout=1)
+    await fake.stop()
+    scratch.cleanup()
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency or args.requests,
+        "nodes": source.num_nodes,
+        "jobs": source.num_jobs,
+        "wall_seconds": wall,
+        "throughput": len(results) / wall if wall else 0.0,
+        "slack_calls": dict(fake.calls),
+        "slurm_fetches": dict(source.fetch_count),
+        "commands": _summarize(results),
+    }
+
+
+def _summarize(results):
+    by_command = {}
+    for result in results:
+        by_command.setdefault(result["command"], []).append(result)
+    by_command["all"] = results
+    summary = {}
+    for command, rows in by_command.items():
+        acks = [row["ack_seconds"] for row in rows]
+        completions = [row["completion_seconds"] for row in rows if row["completion_seconds"] is not None]
+        summary[command] = {
+            "count": len(rows),
+            "errors": sum(row["error"] for row in rows),
+            **{f"ack_p{q}": _percentile(acks, q / 100) for q in (50, 95, 99)},
+            **{f"completion_p{q}": _percentile(completions, q / 100) for q in (50, 95, 99)},
+        }
+    return summary
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.1f}"
+
+
+def report(result):
+    print(f"{result['requests']} requests ({result['concurrency']} concurrent) against {result['nodes']} nodes, "
+          f"{result['jobs']} jobs: {result['wall_seconds']:.2f}s, {result['throughput']:.1f} req/s")
+    print()
+    rows = [
+        [command, s["count"], s["errors"]] + [_ms(s[f"ack_p{q}"]) for q in (50, 95, 99)]
+        + [_ms(s[f"completion_p{q}"]) for q in (50, 95, 99)]
+        for command, s in result["commands"].items()
+    ]
+    print(tabulate(rows, headers=["Command", "Requests", "Errors", "Ack p50", "Ack p95", "Ack p99",
+                                  "Done p50", "Done p95", "Done p99"], tablefmt="github"))
+    print()
+    print("Slack API calls: " + ", ".join(f"{method} {count}" for method, count in sorted(result["slack_calls"].items())))
+    print("Slurm fetches: " + ", ".join(f"{kind} {count}" for kind, count in sorted(result["slurm_fetches"].items())))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--requests", type=int, default=200, help="slash commands to send")
+    parser.add_argument("-c", "--concurrency", type=int, default=0, help="requests in flight at once (default: all)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"command:weight list (default: {DEFAULT_MIX})")
+    parser.add_argument("--node-scale", type=int, default=1, help="replicate the fixture nodes this many times")
+    parser.add_argument("--job-scale", type=int, default=1, help="replicate the fixture jobs this many times")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per fixture Slurm query")
+    parser.add_argument("--slack-latency", type=float, default=0.0, help="seconds per fake Slack API call")
+    parser.add_argument("--no-warm-up", dest="warm_up", action="store_false",
+                        help="send the load right away instead of after the startup warm-up")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds a handler may take before counting as failed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--save", help="write the results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(_run(args))
+    report(result)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+    return 1 if result["commands"]["all"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
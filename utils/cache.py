@@ -0,0 +1,188 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# name -> TTLCache, for reporting
+CACHES = {}
+
+
+def _is_empty(value):
+    if value is None:
+        return True
+    try:
+        return len(value) == 0
+    except TypeError:
+        return False
+
+
+class _Entry:
+    __slots__ = ("value", "fresh_until", "stale_until")
+
+    def __init__(self, value, fresh_until, stale_until):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    Thread-safe, argument-keyed cache with LRU eviction.
+
+    - Entries are fresh for `ttl` seconds. After that they may still be served
+      for `stale_ttl` more seconds while a background thread reloads them
+      (stale-while-revalidate).
+    - Concurrent misses on the same key share one load (single-flight); the
+      other callers wait for its result instead of calling the loader again.
+    - Results for which `is_negative(value)` is true (by default None or empty)
+      are kept for `negative_ttl` seconds instead of `ttl`, so a failing backend
+      is not retried on every call. They are never served stale.
+    - Exceptions raised by the loader are passed to every waiting caller and are
+      not cached.
+
+    Args:
+        name (str): name used in logs and `stats()`.
+        ttl (float): seconds a value is fresh.
+        maxsize (int): maximum number of keys kept.
+        stale_ttl (float): extra seconds an expired value may be served while reloading.
+        negative_ttl (float): seconds a negative result is kept. Defaults to `ttl`.
+        is_negative (callable): predicate marking negative results.
+    """
+
+    def __init__(self, name, ttl, maxsize=128, stale_ttl=0, negative_ttl=None, is_negative=_is_empty):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.is_negative = is_negative
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ("hits", "stale_hits", "misses", "coalesced", "loads", "negative_loads", "errors", "evictions"), 0
+        )
+        self._load_seconds_total = 0.0
+        self._load_seconds_max = 0.0
+
+    def get(self, key, loader):
+        """Return the cached value for `key`, calling `loader()` to (re)load it when needed."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.fresh_until:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return entry.value
+            if entry is not None and now < entry.stale_until:
+                self._entries.move_to_end(key)
+                self._counters["stale_hits"] += 1
+                if key not in self._flights:
+                    flight = self._flights[key] = _Flight()
+                    threading.Thread(
+                        target=self._load, args=(key, loader, flight), name=f"cache-{self.name}", daemon=True
+                    ).start()
+                return entry.value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._counters["misses"] += 1
+            else:
+                self._counters["coalesced"] += 1
+
+        if leader:
+            self._load(key, loader, flight)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _load(self, key, loader, flight):
+        start = time.monotonic()
+        try:
+            flight.value = loader()
+        except BaseException as e:
+            flight.error = e
+            logger.error(f"Cache {self.name}: loading {key!r} failed: {e}")
+        finally:
+            end = time.monotonic()
+            with self._lock:
+                elapsed = end - start
+                self._counters["loads"] += 1
+                self._load_seconds_total += elapsed
+                self._load_seconds_max = max(self._load_seconds_max, elapsed)
+                if flight.error is not None:
+                    self._counters["errors"] += 1
+                else:
+                    self._store(key, flight.value, end)
+                del self._flights[key]
+            flight.done.set()
+
+    def _store(self, key, value, now):
+        if self.is_negative(value):
+            self._counters["negative_loads"] += 1
+            fresh_until = stale_until = now + self.negative_ttl
+        else:
+            fresh_until = now + self.ttl
+            stale_until = fresh_until + self.stale_ttl
+        self._entries[key] = _Entry(value, fresh_until, stale_until)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+            stats["load_ms_avg"] = self._load_seconds_total / stats["loads"] * 1000 if stats["loads"] else 0.0
+            stats["load_ms_max"] = self._load_seconds_max * 1000
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_rate"] = (stats["hits"] + stats["stale_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+def ttl_cache(ttl, maxsize=128, stale_ttl=0, negative_ttl=None, is_negative=_is_empty):
+    """
+    Decorator caching a function's results per arguments in a `TTLCache`.
+
+    The cache is reachable as `func.cache` and `func.cache_clear()` empties it;
+    `func.__wrapped__` calls the undecorated function.
+    """
+    def decorator(func):
+        name = f"{func.__module__}.{func.__qualname__}"
+        cache = TTLCache(name, ttl, maxsize=maxsize, stale_ttl=stale_ttl, negative_ttl=negative_ttl, is_negative=is_negative)
+        CACHES[name] = cache
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+            return cache.get(key, lambda: func(*args, **kwargs))
+
+        wrapper.cache = cache
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+
+def get_cache_stats():
+    return {name: cache.stats() for name, cache in CACHES.items()}
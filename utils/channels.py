@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+from aiohttp import ClientError
+from slack_sdk.errors import SlackApiError
+
+import config
+from utils.log import get_logger
+from utils.trace import span
+
+logger = get_logger(__name__)
+
+NOT_IN_CHANNEL = "I need to be invited to this channel to use this command. Please add me using `/invite @botname`"
+
+
+class ChannelMembership:
+    """
+    Whether the bot is a member of a channel, cached per channel.
+
+    The bot's own user id is resolved once (`resolve_identity()`, at startup).
+    A lookup is a single `conversations.info` call whose result is kept for
+    CHANNEL_MEMBERSHIP_TTL seconds; `member_joined_channel`/`member_left_channel`
+    events for the bot update the cache directly. Concurrent lookups of the
+    same channel share one call. While Slack rate-limits us (429) no calls are
+    made until Retry-After has passed and the last known answer is used, or
+    None ("unknown") if there is none; the same goes when Slack can't be reached.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = config.CHANNEL_MEMBERSHIP_TTL if ttl is None else ttl
+        self.bot_user_id = None
+        # channel id -> (is_member, expires_at)
+        self._cache = {}
+        self._pending = {}
+        self._retry_at = 0.0
+
+    async def resolve_identity(self, client):
+        if self.bot_user_id is None:
+            with span("slack.auth_test"):
+                self.bot_user_id = (await client.auth_test())["user_id"]
+            logger.info(f"Running as bot user {self.bot_user_id}")
+        return self.bot_user_id
+
+    def set_member(self, channel_id, is_member):
+        self._cache[channel_id] = (is_member, time.monotonic() + self.ttl)
+
+    def on_member_event(self, event):
+        """`member_joined_channel`/`member_left_channel` handler: only the bot's own membership is tracked."""
+        if self.bot_user_id is None or event.get("user") != self.bot_user_id:
+            return
+        self.set_member(event["channel"], event["type"] == "member_joined_channel")
+
+    async def is_member(self, client, channel_id):
+        """True/False, or None when it can't be determined right now."""
+        cached = self._cache.get(channel_id)
+        now = time.monotonic()
+        if cached is not None and now < cached[1]:
+            return cached[0]
+        if now < self._retry_at:
+            return cached[0] if cached else None
+
+        pending = self._pending.get(channel_id)
+        if pending is None:
+            pending = self._pending[channel_id] = asyncio.ensure_future(self._lookup(client, channel_id, cached))
+            pending.add_done_callback(lambda _: self._pending.pop(channel_id, None))
+        return await asyncio.shield(pending)
+
+    async def _lookup(self, client, channel_id, cached):
+        try:
+            with span("slack.conversations_info"):
+                response = await client.conversations_info(channel=channel_id)
+            channel = response["channel"]
+            # a DM the bot can see is one with the bot, which carries no is_member flag
+            is_member = bool(channel.get("is_member") or channel.get("is_im"))
+        except SlackApiError as e:
+            if e.response.status_code == 429:
+                headers = e.response.headers or {}
+                retry_after = float(headers.get("Retry-After") or headers.get("retry-after") or 1)
+                self._retry_at = time.monotonic() + retry_after
+                logger.warning(f"Rate limited checking channel membership, backing off for {retry_after:g}s")
+                return cached[0] if cached else None
+            # non-JSON error bodies (e.g. from a proxy) carry no error code
+            error = e.response.data.get("error") if isinstance(e.response.data, dict) else None
+            if error in ("channel_not_found", "not_in_channel"):
+                # private channels and DMs the bot isn't part of are invisible to it
+                is_member = False
+            else:
+                logger.error(f"Error checking channel membership: {error or e.response.status_code}")
+                return cached[0] if cached else None
+        except (ClientError, asyncio.TimeoutError) as e:
+            # Slack unreachable: same as unknown, the gate lets the command through
+            logger.warning(f"Could not reach Slack to check channel membership: {e!r}")
+            return cached[0] if cached else None
+        self.set_member(channel_id, is_member)
+        return is_member
+
+
+_membership = ChannelMembership()
+
+
+def get_channel_membership():
+    return _membership
+
+
+def require_bot_in_channel(membership=None):
+    """
+    Bolt middleware rejecting slash commands from channels the bot isn't in.
+    Other requests pass through, and so do commands when membership is unknown
+    (e.g. while rate-limited), so the gate never blocks on Slack.
+    """
+    membership = membership or get_channel_membership()
+
+    async def middleware(client, body, payload, ack, next):
+        if "command" not in body:
+            return await next()
+        await membership.resolve_identity(client)
+        if await membership.is_member(client, payload.get("channel_id")) is False:
+            await ack(text=NOT_IN_CHANNEL)
+            return
+        return await next()
+
+    return middleware
@@ -0,0 +1,53 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import config
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# path -> (handler returning the response body as str, content type)
+ROUTES = {}
+
+
+def register_route(path, handler, content_type="text/plain; charset=utf-8"):
+    """Serve `handler()` on GET `path` from the local HTTP server."""
+    ROUTES[path] = (handler, content_type)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        route = ROUTES.get(urlsplit(self.path).path)
+        if route is None:
+            self.send_error(404, explain=f"Known paths: {', '.join(sorted(ROUTES))}")
+            return
+        handler, content_type = route
+        try:
+            body = handler().encode()
+        except Exception as e:
+            logger.error(f"Error serving {self.path}: {e}")
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def start_http_server(host=None, port=None):
+    """
+    Serve ROUTES on a daemon thread. Binds to config.HTTP_HOST (localhost by
+    default), since nothing here is authenticated.
+    """
+    host = config.HTTP_HOST if host is None else host
+    port = config.HTTP_PORT if port is None else port
+    server = ThreadingHTTPServer((host, port), _RequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="http-server", daemon=True).start()
+    logger.info(f"Serving {', '.join(sorted(ROUTES))} on http://{host}:{server.server_port}")
+    return server
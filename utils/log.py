@@ -2,20 +2,27 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
 import atexit
 import functools
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import sys
 import time
 from collections import Counter
-from datetime import datetime
+from datetime import datetime, timezone
 
-from tabulate import tabulate
-from termcolor import colored
-from iopath.common.file_io import PathManager as PathManagerBase
 from config import LOGGER_PREFIX
 
+# termcolor, iopath and tabulate are imported where they are first used, so
+# importing this module (which every other module does) stays cheap
+
+
+@functools.lru_cache(maxsize=None)
+def _path_manager():
+    from iopath.common.file_io import PathManager as PathManagerBase
+    return PathManagerBase()
 
-PathManager = PathManagerBase()
 
 def get_logger(name):
     if name != '' and not name.startswith(f'{LOGGER_PREFIX}.'):
@@ -33,6 +40,7 @@ class _ColorfulFormatter(logging.Formatter):
         super(_ColorfulFormatter, self).__init__(*args, **kwargs)
 
     def formatMessage(self, record):
+        from termcolor import colored
         record.name = record.name.replace(self._root_name, self._abbrev_name)
         log = super(_ColorfulFormatter, self).formatMessage(record)
         if record.levelno == logging.WARNING:
@@ -44,9 +52,48 @@ class _ColorfulFormatter(logging.Formatter):
         return prefix + " " + log
 
 
+class _JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    `RotatingFileHandler` that also rolls over every `interval` seconds, whichever
+    comes first. Backups are numbered `<file>.1` ... `<file>.<backup_count>`.
+    """
+
+    def __init__(self, filename, max_bytes=0, interval=0, backup_count=0):
+        super().__init__(filename, mode="a", maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.interval = interval
+        self._rollover_at = time.time() + interval if interval else None
+
+    def shouldRollover(self, record):
+        if self._rollover_at is not None and time.time() >= self._rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self._rollover_at is not None:
+            self._rollover_at = time.time() + self.interval
+
+
 @functools.lru_cache()  # so that calling setup_logger multiple times won't add many handlers
 def setup_logger(
-        output=None, level=logging.INFO, distributed_rank=0, *, color=True, name=LOGGER_PREFIX, abbrev_name=None
+        output=None, level=logging.INFO, distributed_rank=0, *, color=True, name=LOGGER_PREFIX, abbrev_name=None,
+        use_queue=False, json_lines=False, max_bytes=0, rotate_seconds=0, backup_count=0
 ):
     """
     Initialize the detectron2 logger and set its verbosity level to "DEBUG".
@@ -60,6 +107,12 @@ def setup_logger(
             Set to "" to not log the root module in logs.
             By default, will abbreviate "detectron2" to "d2" and leave other
             modules unchanged.
+        use_queue (bool): only enqueue records in the logging thread; a QueueListener
+            thread formats them and does the stdout/file I/O.
+        json_lines (bool): write the log file as JSON lines instead of plain text.
+        max_bytes (int): roll the log file over once it reaches this size (0: never).
+        rotate_seconds (int): roll the log file over after this many seconds (0: never).
+        backup_count (int): rolled-over files to keep.
 
     Returns:
         logging.Logger: a logger
@@ -67,6 +120,7 @@ def setup_logger(
     logger = logging.getLogger(name)
     logger.setLevel(level)
     logger.propagate = False
+    handlers = []
 
     # if abbrev_name is None:
     #     abbrev_name = "vgg" if name == LOGGER_PREFIX else name
@@ -79,6 +133,7 @@ def setup_logger(
         ch = logging.StreamHandler(stream=sys.stdout)
         ch.setLevel(level)
         if color:
+            from termcolor import colored
             formatter = _ColorfulFormatter(
                 colored("[%(asctime)s %(levelname)s %(name)s]: ", "green") + "%(message)s",
                 datefmt="%m/%d %H:%M:%S",
@@ -88,7 +143,7 @@ def setup_logger(
         else:
             formatter = plain_formatter
         ch.setFormatter(formatter)
-        logger.addHandler(ch)
+        handlers.append(ch)
 
     # file logging: all workers
     if output is not None:
@@ -98,12 +153,28 @@ def setup_logger(
             filename = os.path.join(output,  f"log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
         if distributed_rank > 0:
             filename = filename + ".rank{}".format(distributed_rank)
-        PathManager.mkdirs(os.path.dirname(filename))
+        if "://" in filename:
+            _path_manager().mkdirs(os.path.dirname(filename))
+        else:
+            os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
 
-        fh = logging.StreamHandler(_cached_log_stream(filename))
+        if max_bytes or rotate_seconds:
+            fh = _SizeAndTimeRotatingFileHandler(filename, max_bytes, rotate_seconds, backup_count)
+        else:
+            fh = logging.StreamHandler(_cached_log_stream(filename))
         fh.setLevel(logging.DEBUG)
-        fh.setFormatter(plain_formatter)
-        logger.addHandler(fh)
+        fh.setFormatter(_JsonFormatter() if json_lines else plain_formatter)
+        handlers.append(fh)
+
+    if use_queue:
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
 
     return logger
 
@@ -112,8 +183,11 @@ def setup_logger(
 # with the same file name can safely write to the same file.
 @functools.lru_cache(maxsize=None)
 def _cached_log_stream(filename):
-    # use 1K buffer if writing to cloud storage
-    io = PathManager.open(filename, "a", buffering=1024 if "://" in filename else -1)
+    # use 1K buffer if writing to cloud storage; only cloud paths need iopath
+    if "://" in filename:
+        io = _path_manager().open(filename, "a", buffering=1024)
+    else:
+        io = open(filename, "a")
     atexit.register(io.close)
     return io
 
@@ -125,6 +199,12 @@ https://github.com/abseil/abseil-py/blob/master/absl/logging/__init__.py
 """
 
 
+# co_filename of every function in this module; frames from here are skipped with one string comparison
+_THIS_FILE = sys._getframe().f_code.co_filename
+# (code object, line) -> (module name, caller key), so repeated calls from one site skip building them
+_CALLERS = {}
+
+
 def _find_caller():
     """
     Returns:
@@ -134,11 +214,15 @@ def _find_caller():
     frame = sys._getframe(2)
     while frame:
         code = frame.f_code
-        if os.path.join("utils", "log") not in code.co_filename:
-            mod_name = frame.f_globals["__name__"]
-            if mod_name == "__main__":
-                mod_name = LOGGER_PREFIX
-            return mod_name, (code.co_filename, frame.f_lineno, code.co_name)
+        if code.co_filename != _THIS_FILE:
+            site = (code, frame.f_lineno)
+            caller = _CALLERS.get(site)
+            if caller is None:
+                mod_name = frame.f_globals["__name__"]
+                if mod_name == "__main__":
+                    mod_name = LOGGER_PREFIX
+                caller = _CALLERS[site] = (mod_name, (code.co_filename, frame.f_lineno, code.co_name))
+            return caller
         frame = frame.f_back
 
 
@@ -226,6 +310,7 @@ def create_small_table(small_dict):
     Returns:
         str: the table as a string.
     """
+    from tabulate import tabulate
     keys, values = tuple(zip(*small_dict.items()))
     table = tabulate(
         [values],
@@ -1,55 +1,198 @@
+import json
 import os
+import re
+import time
 from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
-
-import pwd
+from slack_sdk.errors import SlackClientError
 
+import config
 from utils.log import get_logger
-from utils.utils import cache_for_n_seconds
+from utils.cache import ttl_cache
+from utils.trace import traced
+from utils.utils import get_user_directory
 
 logger = get_logger(__name__)
 
+_NON_ALPHA = re.compile(r"[^a-z ]+")
+
 
 def get_slack_users():
-    client = WebClient(token=os.environ.get("SLACK_BOT_TOKEN"))
+    """All active, human members of the workspace, paging through users.list."""
+    client = WebClient(token=os.environ.get("SLACK_BOT_TOKEN"), base_url=config.SLACK_API_URL)
 
+    members = []
+    cursor = None
     try:
-        # Call the users.list method using the WebClient
-        # users.list requires the users:read scope
-        result = client.users_list()["members"]
-        return result
-
-    except SlackApiError as e:
-        logger.error("Error creating conversation: {}".format(e))
+        while True:
+            # users.list requires the users:read scope
+            result = client.users_list(limit=200, cursor=cursor)
+            members.extend(
+                m for m in result["members"]
+                if not m.get("deleted") and not m.get("is_bot") and m.get("id") != "USLACKBOT"
+            )
+            cursor = result.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                return members
+    except (SlackClientError, OSError) as e:
+        # API errors as well as transport failures (URLError, timeouts, refused connections)
+        logger.error("Error listing Slack users: {}".format(e))
         return []
 
 
-@cache_for_n_seconds(seconds=24 * 60 * 60)
-def get_slack2unix_map():
-    hardcoded_map = {
-        "U07BESQTQM6": "ramirezc",
-        "U086DUX6V4Y": "kresgeb"
-    }
-    logger.info("Using hardcoded mapping in get_slack2unix_map")
-    logger.info("Starting get_slack2unix_map")
-    slack2unix_map = hardcoded_map.copy()
-    # slack_users = get_slack_users()
-    # for linux_user in pwd.getpwall():
-    #     if linux_user.pw_uid < 100 or linux_user.pw_name.startswith('.'):
-    #         continue
-    #     # Get the GECOS field - this is the 5th field in /etc/passwd
-    #     linux_gecos = linux_user.pw_gecos
-        
-    #     for slack_user in slack_users:
-    #         if slack_user['id'] == 'U01UCDZ1RT3':
-    #             continue
-    #         if 'real_name' in slack_user:
-    #             # Debug log to see what's being compared
-    #             logger.debug(f"Comparing - Slack: '{slack_user['real_name']}' with Unix: '{linux_gecos}'")
-                
-    #             # Perform exact matching - the real_name must be exactly the same as the GECOS field
-    #             if slack_user['real_name'] == linux_gecos:
-    #                 # Found exact match - add to mapping
-    #                 slack2unix_map[slack_user['id']] = linux_user.pw_name
-    #                 logger.info(f"Exact match found - Slack: {slack_user['real_name']} -> Unix: {linux_user.pw_name}")
-    return slack2unix_map
+def normalize_name(name):
+    """'José  O'Neil-Smith' -> 'jose oneilsmith': ASCII, lower case, letters and single spaces only."""
+    from unidecode import unidecode
+    name = unidecode(name or "").lower().replace("-", "").replace("'", "")
+    return " ".join(_NON_ALPHA.sub(" ", name).split())
+
+
+def _slack_names(member):
+    profile = member.get("profile", {})
+    names = (member.get("real_name"), profile.get("real_name"), profile.get("real_name_normalized"))
+    return {n for n in map(normalize_name, names) if n}
+
+
+class _FuzzyIndex:
+    """Unix real names blocked by the initials of their tokens, so each lookup only scores a small candidate set."""
+
+    def __init__(self, names):
+        self._blocks = {}
+        for name in names:
+            for token in name.split():
+                self._blocks.setdefault(token[0], set()).add(name)
+
+    def best_match(self, name, threshold):
+        candidates = set()
+        for token in name.split():
+            candidates |= self._blocks.get(token[0], set())
+        if not candidates:
+            return None
+        from thefuzz import fuzz, process
+        match = process.extractOne(name, candidates, scorer=fuzz.token_sort_ratio, score_cutoff=threshold)
+        return match[0] if match else None
+
+
+def build_slack2unix_map(slack_users, unix_users, previous=None, threshold=None):
+    """
+    Match Slack members to Unix accounts.
+
+    Exact matches come from a hash join of normalized Slack real names against
+    normalized GECOS names; members left over are fuzzy matched against the
+    remaining Unix names that share a token initial. Members whose Slack
+    profile is unchanged since `previous` keep their previous match.
+
+    Args:
+        slack_users (list[dict]): members as returned by users.list.
+        unix_users (list[User]): candidate Unix accounts.
+        previous (dict): slack id -> entry, as returned by an earlier call.
+        threshold (int): minimum thefuzz token_sort_ratio for a fuzzy match.
+
+    Returns:
+        dict: slack id -> {"unix": username, "method": "exact" | "fuzzy", "updated": profile timestamp}
+    """
+    previous = previous or {}
+    threshold = config.SLACK2UNIX_FUZZY_THRESHOLD if threshold is None else threshold
+    usernames = {user.username for user in unix_users}
+
+    by_name = {}
+    ambiguous = set()
+    for user in unix_users:
+        name = normalize_name(user.real_name)
+        if not name:
+            continue
+        if name in by_name and by_name[name] != user.username:
+            ambiguous.add(name)
+        by_name[name] = user.username
+    for name in ambiguous:
+        logger.warning(f"Several Unix accounts share the name '{name}', not matching it automatically")
+        del by_name[name]
+
+    mapping = {}
+    leftovers = []
+    for member in slack_users:
+        slack_id = member["id"]
+        updated = member.get("updated")
+        entry = previous.get(slack_id)
+        if entry and entry.get("updated") == updated and entry["unix"] in usernames:
+            mapping[slack_id] = entry
+            continue
+        match = next((by_name[n] for n in _slack_names(member) if n in by_name), None)
+        if match:
+            mapping[slack_id] = {"unix": match, "method": "exact", "updated": updated}
+        else:
+            leftovers.append(member)
+
+    if leftovers:
+        taken = {entry["unix"] for entry in mapping.values()}
+        fuzzy_index = _FuzzyIndex(name for name, username in by_name.items() if username not in taken)
+        for member in leftovers:
+            for name in _slack_names(member):
+                match = fuzzy_index.best_match(name, threshold)
+                if match and by_name[match] not in taken:
+                    taken.add(by_name[match])
+                    logger.info(f"Fuzzy match - Slack: {member.get('real_name')} -> Unix: {by_name[match]}")
+                    mapping[member["id"]] = {"unix": by_name[match], "method": "fuzzy", "updated": member.get("updated")}
+                    break
+    return mapping
+
+
+def _load_map(path):
+    try:
+        with open(path) as f:
+            return json.load(f).get("users", {})
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable Slack to Unix map {path}: {e}")
+        return {}
+
+
+def _save_map(path, mapping):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"saved_at": time.time(), "users": mapping}, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+class _PersistedMap(dict):
+    """A Slack to Unix map read back from disk because Slack couldn't be listed."""
+
+
+def _is_fallback(slack2unix_map):
+    return not slack2unix_map or isinstance(slack2unix_map, _PersistedMap)
+
+
+# a map served from disk is only kept for the negative TTL, so new users are picked up soon after Slack recovers
+@ttl_cache(ttl=24 * 60 * 60, stale_ttl=60 * 60, negative_ttl=5 * 60, is_negative=_is_fallback)
+def get_slack2unix_map(path=None):
+    """
+    Slack user id -> Unix username for the whole workspace.
+
+    Members are refreshed incrementally from users.list against the map
+    persisted at `path` (config.SLACK2UNIX_MAP_PATH), and
+    config.SLACK2UNIX_OVERRIDES always win.
+    """
+    path = path or config.SLACK2UNIX_MAP_PATH
+    previous = _load_map(path)
+    slack_users = get_slack_users()
+    if slack_users:
+        start = time.time()
+        mapping = build_slack2unix_map(slack_users, get_user_directory().users, previous)
+        logger.info(f"Mapped {len(mapping)} of {len(slack_users)} Slack users in {(time.time() - start) * 1000:.2f} ms")
+        if mapping != previous:
+            _save_map(path, mapping)
+    else:
+        logger.warning("Could not list Slack users, using the persisted Slack to Unix map")
+        mapping = previous
+
+    slack2unix_map = {slack_id: entry["unix"] for slack_id, entry in mapping.items()}
+    slack2unix_map.update(config.SLACK2UNIX_OVERRIDES)
+    return slack2unix_map if slack_users else _PersistedMap(slack2unix_map)
+
+
+@traced("user_resolution.slack2unix")
+def lookup_unix_user(slack_id):
+    return get_slack2unix_map().get(slack_id)
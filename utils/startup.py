@@ -0,0 +1,41 @@
+import time
+from contextlib import contextmanager
+
+import config
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class StartupTimer:
+    """
+    Wall-clock time of each startup phase (imports, warm-up steps, ...),
+    reported once when the bot starts taking commands.
+    """
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        # (phase, seconds), in the order the phases finished
+        self.phases = []
+
+    def record(self, phase, seconds):
+        self.phases.append((phase, seconds))
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as phase `name`; works around `await`s too."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        lines = [f"  {phase:<28} {seconds * 1000:10.1f} ms" for phase, seconds in self.phases]
+        logger.info("Startup timing:\n" + "\n".join(lines) + f"\n  {'total':<28} {total * 1000:10.1f} ms")
+        imports = dict(self.phases).get("imports")
+        if imports is not None and imports > config.STARTUP_IMPORT_BUDGET_SECONDS:
+            logger.warning(f"Imports took {imports:.2f}s, over the {config.STARTUP_IMPORT_BUDGET_SECONDS:g}s budget; "
+                           f"run `python -X importtime app.py` to see which module grew")
+        return total
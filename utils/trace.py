@@ -0,0 +1,114 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+# stage name -> LatencyHistogram
+HISTOGRAMS = {}
+_histograms_lock = threading.Lock()
+
+
+class LatencyHistogram:
+    """
+    Thread-safe latency histogram over the fixed TRACE_BUCKETS_MS bounds.
+    Percentiles are estimated as the upper bound of the bucket they fall in.
+    """
+
+    def __init__(self, bounds=None):
+        self.bounds = list(bounds or config.TRACE_BUCKETS_MS)
+        # one extra bucket for everything above the last bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms):
+        index = bisect.bisect_left(self.bounds, ms)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, q):
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = q * self.count
+            seen = 0
+            for bound, count in zip(self.bounds, self.counts):
+                seen += count
+                if seen >= rank:
+                    return min(bound, self.max_ms)
+            return self.max_ms
+
+    def stats(self):
+        with self._lock:
+            count, total_ms, max_ms = self.count, self.total_ms, self.max_ms
+        return {
+            "count": count,
+            "avg_ms": total_ms / count if count else 0.0,
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": max_ms,
+        }
+
+
+def _histogram(stage):
+    histogram = HISTOGRAMS.get(stage)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = HISTOGRAMS.setdefault(stage, LatencyHistogram())
+    return histogram
+
+
+def observe(stage, ms):
+    _histogram(stage).observe(ms)
+
+
+@contextmanager
+def span(stage):
+    """
+    Time the enclosed block into the `stage` histogram, e.g. `with span("slurm.fetch.nodes"):`.
+    Works around `await`s too; failed blocks are recorded under "<stage>.error".
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        observe(f"{stage}.error", (time.perf_counter() - start) * 1000)
+        raise
+    observe(stage, (time.perf_counter() - start) * 1000)
+
+
+def traced(stage):
+    """Decorator form of `span` for plain and async functions."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_latency_stats():
+    return {stage: histogram.stats() for stage, histogram in sorted(HISTOGRAMS.items())}
+
+
+def reset_latency_stats():
+    with _histograms_lock:
+        HISTOGRAMS.clear()
@@ -1,8 +1,15 @@
-import functools
+import grp
+import os
+import pwd
+import threading
 import time
-import subprocess
 from dataclasses import dataclass
 
+import config
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
 # https://stackoverflow.com/a/1094933
 def sizeof_fmt(num, suffix="", with_unit=True):
     for unit in ["M", "G", "T", "P", "E", "Z"]:
@@ -11,17 +18,6 @@ def sizeof_fmt(num, suffix="", with_unit=True):
         num /= 1024.0
     return (int(num), f"Y{suffix}") if with_unit else int(num)
 
-def cache_for_n_seconds(seconds=1800):
-    def decorator_cache_for_n_seconds(func):
-        @functools.wraps(func)
-        def wrapper_cache_for_n_seconds(*args, **kwargs):
-            if not hasattr(wrapper_cache_for_n_seconds, "last_call_value") or len(wrapper_cache_for_n_seconds.last_call_value) == 0 or time.time() - wrapper_cache_for_n_seconds.last_call_time >= seconds:
-                wrapper_cache_for_n_seconds.last_call_time = time.time()
-                wrapper_cache_for_n_seconds.last_call_value = func(*args, **kwargs)
-            return wrapper_cache_for_n_seconds.last_call_value
-        return wrapper_cache_for_n_seconds
-    return decorator_cache_for_n_seconds
-
 def _format_time(seconds):
     days = int(seconds / (24 * 60 * 60))
     hours = int((seconds % (24 * 60 * 60)) / (60 * 60))
@@ -44,77 +40,104 @@ class User:
     unix_uid: str = None
     real_name: str = None
 
-def _get_users():
-    user_groups = ["xusers", "zusers", "tusers", "rusers", "musers"]
-    result = ""
-    for user_group in user_groups:
-        result += (subprocess.run(['getent', 'group', f"{user_group}"], capture_output=True, text=True)).stdout
-
-    users_groups = result.strip().split('\n')
-
-    members = []
-    for user_group in users_groups:
-        fields = user_group.split(':')
-        members.extend(fields[-1].split(','))
-
-    user_info = []
-    for member in set(members):
-        result = subprocess.run(['getent', 'passwd', f"{member}"], capture_output=True, text=True)
-        users_data = result.stdout.strip().split('\n')
-
-        for user_line in users_data:
-            fields = user_line.split(':')
-            username, _, unix_uid, _, real_name = fields[:5]
-            user_info.append(User(str(username), str(unix_uid), str(real_name)))
-            
-    return user_info
-
-def _require_bot_in_channel(logger):
-    def middleware(next):
-        def process(body, client, context, payload, **kwargs):
-            # Get necessary information
-            channel_id = payload.get("channel_id")
-            user_id = payload.get("user_id")
-            
+def _normalize_name(name):
+    return " ".join(name.split()).casefold()
+
+class UserDirectory:
+    """
+    In-process index of the Unix accounts in `groups`, built from nss (`grp`/`pwd`)
+    in one pass and looked up by uid, username or GECOS real name in O(1).
+
+    The index is rebuilt only when /etc/passwd or /etc/group change, or after
+    `max_age` seconds so accounts served by LDAP/sssd are picked up too.
+    """
+
+    def __init__(self, groups=None, max_age=None, watched_files=("/etc/passwd", "/etc/group")):
+        self.groups = groups if groups is not None else config.USER_GROUPS
+        self.max_age = max_age if max_age is not None else config.USER_DIRECTORY_MAX_AGE
+        self.watched_files = watched_files
+        self._lock = threading.Lock()
+        self._signature = None
+        self._loaded_at = 0.0
+        # (by_uid, by_username, by_real_name), swapped as a whole on reload
+        self._indexes = ({}, {}, {})
+
+    def _file_signature(self):
+        signature = []
+        for path in self.watched_files:
+            try:
+                signature.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _is_stale(self, signature):
+        return signature != self._signature or time.monotonic() - self._loaded_at >= self.max_age
+
+    def _ensure_loaded(self):
+        signature = self._file_signature()
+        if not self._is_stale(signature):
+            return
+        with self._lock:
+            if self._is_stale(signature):
+                self._indexes = self._load()
+                self._signature = signature
+                self._loaded_at = time.monotonic()
+
+    def _load(self):
+        members = set()
+        gids = set()
+        for group_name in self.groups:
             try:
-                # Get bot's user ID
-                bot_info = client.auth_test()
-                bot_user_id = bot_info["user_id"]
-                
-                # Check if bot is in channel
-                try:
-                    response = client.conversations_members(channel=channel_id)
-                    members = response.get("members", [])
-                    
-                    if bot_user_id not in members:
-                        # Bot is not in the channel, send ephemeral message
-                        client.chat_postEphemeral(
-                            channel=channel_id,
-                            user=user_id,
-                            text="I need to be invited to this channel to use this command. Please add me using `/invite @botname`"
-                        )
-                        return  # Stop processing
-                    
-                    # Bot is in channel, proceed with next middleware/handler
-                    return next(**kwargs)
-                    
-                except Exception as e:
-                    logger.error(f"Error checking channel membership: {e}")
-                    client.chat_postEphemeral(
-                        channel=channel_id,
-                        user=user_id,
-                        text=f"Error: Could not verify channel membership. {str(e)}"
-                    )
-                    return
-                    
-            except Exception as e:
-                logger.error(f"Error in bot_in_channel middleware: {e}")
-                client.chat_postEphemeral(
-                    channel=channel_id,
-                    user=user_id,
-                    text="An unexpected error occurred"
-                )
-                return
-                
-        return process
-    return middleware
\ No newline at end of file
+                group = grp.getgrnam(group_name)
+            except KeyError:
+                logger.warning(f"Group {group_name} not found")
+                continue
+            gids.add(group.gr_gid)
+            members.update(group.gr_mem)
+
+        accounts = {}
+        for entry in pwd.getpwall():
+            if entry.pw_name in members or entry.pw_gid in gids:
+                accounts[entry.pw_name] = entry
+        # nss backends such as sssd may not enumerate every account in getpwall()
+        for member in members - accounts.keys():
+            try:
+                accounts[member] = pwd.getpwnam(member)
+            except KeyError:
+                logger.warning(f"Group member {member} has no passwd entry")
+
+        by_uid, by_username, by_real_name = {}, {}, {}
+        for entry in accounts.values():
+            user = User(entry.pw_name, str(entry.pw_uid), entry.pw_gecos.split(",")[0])
+            by_uid[user.unix_uid] = user
+            by_username[user.username] = user
+            if user.real_name:
+                by_real_name.setdefault(_normalize_name(user.real_name), user)
+        logger.info(f"Loaded {len(by_uid)} users from groups {', '.join(self.groups)}")
+        return by_uid, by_username, by_real_name
+
+    @property
+    def users(self):
+        self._ensure_loaded()
+        return list(self._indexes[0].values())
+
+    def by_uid(self, unix_uid):
+        self._ensure_loaded()
+        return self._indexes[0].get(str(unix_uid))
+
+    def by_username(self, username):
+        self._ensure_loaded()
+        return self._indexes[1].get(username)
+
+    def by_real_name(self, real_name):
+        self._ensure_loaded()
+        return self._indexes[2].get(_normalize_name(real_name)) if real_name else None
+
+_user_directory = UserDirectory()
+
+def get_user_directory():
+    return _user_directory
+
+def _get_users():
+    return get_user_directory().users